@@ -0,0 +1,485 @@
+"""
+Bulk analysis of exported interviews.
+
+Loads every times_*.parquet / times_*.csv written by export.py into one frame
+and, for a whole wave at once, writes to ANALYTICS_DIRECTORY:
+
+  question_stats.csv   per outline question: answers, answer length, think time, bot latency
+  funnel.csv           conversations reaching each phase of the interview outline
+  languages.csv        conversations per interview language
+  codes.csv            one row per answer, one boolean column per code (dictionary matching)
+  code_counts.csv      answers matching each code, per question
+  llm_codes.csv        codes assigned by an LLM (only with --llm-coding)
+
+Assistant messages are mapped to outline questions by matching each question's
+distinctive words, and interviews only ever move forward, so later messages inherit
+the furthest question reached. Answers belong to the question asked just before them.
+The outline's keywords are English, so Turkish and Russian interviews (detected from
+the bot's messages after the language choice) are left unassigned: they are counted
+in languages.csv but not in the per-question statistics, funnel or coding.
+
+Code dictionaries come from config.ANALYTICS_CODES, one code per line as `name: term, term*`
+(`*` matches any word ending), or from a JSON file {"name": ["term", ...]} via --codes.
+With --llm-coding openai|anthropic, answers are also coded through the provider's
+batch API; results are cached in ANALYTICS_DIRECTORY/llm_coding_cache.jsonl so only
+new answers are sent again.
+
+Needs the research dependencies (requirements-research.txt).
+
+Usage: python analytics.py [--codes codes.json] [--llm-coding openai|anthropic] [--llm-model MODEL]
+"""
+import os
+import re
+import glob
+import json
+import time
+import hashlib
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+
+import config
+
+logger = logging.getLogger(__name__)
+
+PHASE_HEADING = re.compile(r"^(\d+)\.\s+([^(]+?)\s*(?:\(.*)?$")
+SECTION_HEADING = re.compile(r"^[A-Z][A-Z ,\-]+:\s*$")
+QUESTION_HEADING = re.compile(r"^(Q\d+)\s+[—-]\s+(.+?)\s*$")
+QUOTED = re.compile(r'"([^"\n]+)"')
+WORD = re.compile(r"[a-z]+")
+CYRILLIC = "[\u0400-\u04ff]"
+TURKISH = r"[ğışİĞŞ]" # letters used in Turkish but not in English (or Russian)
+LETTER = r"[^\W\d_]"
+
+# Languages whose interviews can be mapped to the (English) outline questions
+OUTLINE_LANGUAGES = ("en", "unknown")
+
+STOPWORDS = set("""
+about after also and any are been being but can could did does doing for from had has
+have how into just like more most much one only other our out over same should some such
+than that the their them then there these they this those through very was were what when
+where which while who why will with would you your yours yourself feel tell usually really
+""".split())
+
+# Keyword hits for an assistant message to count as asking a question
+# (fewer if the question has fewer distinctive words)
+MIN_QUESTION_SCORE = 2
+
+
+def parse_outline(outline: str = config.INTERVIEW_OUTLINE) -> pd.DataFrame:
+    """
+    One row per outline question: order, question_id, phase number and name, prompt text.
+    Questions are the `Qn` blocks of a phase, or else its quoted prompts; a phase
+    without either is a single question made of its whole text.
+    """
+    sections = []
+    current = None
+    for line in outline.splitlines():
+        heading = PHASE_HEADING.match(line)
+        if heading:
+            current = {"phase": int(heading.group(1)), "phase_name": heading.group(2).title(), "lines": []}
+            sections.append(current)
+        elif SECTION_HEADING.match(line):
+            current = None # guidelines after the flow, not part of a phase
+        elif current is not None:
+            current["lines"].append(line)
+
+    rows = []
+    for section in sections:
+        blocks = []
+        for line in section["lines"]:
+            question = QUESTION_HEADING.match(line)
+            if question:
+                blocks.append((question.group(1), question.group(2), []))
+            elif blocks:
+                blocks[-1][2].append(line)
+        if blocks:
+            questions = [(question_id, " ".join([title] + QUOTED.findall("\n".join(lines))))
+                         for question_id, title, lines in blocks]
+        else:
+            text = "\n".join(section["lines"])
+            prompts = QUOTED.findall(text)
+            questions = [(f"P{section['phase']}.{i + 1}", prompt) for i, prompt in enumerate(prompts)] \
+                or [(f"P{section['phase']}", text)]
+        for question_id, text in questions:
+            rows.append({"question_id": question_id, "phase": section["phase"],
+                         "phase_name": section["phase_name"], "text": " ".join(text.split())})
+    questions = pd.DataFrame(rows)
+    questions.insert(0, "order", np.arange(len(questions)))
+    return questions
+
+
+def question_keywords(questions: pd.DataFrame, max_share: float = 0.2) -> pd.Series:
+    """
+    Distinctive words per question: no stopwords, no short words, and none that appear
+    in more than `max_share` of the questions.
+    """
+    words = questions["text"].str.lower().map(
+        lambda text: {word for word in WORD.findall(text) if len(word) > 3 and word not in STOPWORDS}
+    )
+    document_frequency = pd.Series([word for question_words in words for word in question_words]).value_counts()
+    common = set(document_frequency[document_frequency > max(1, max_share * len(questions))].index)
+    return words.map(lambda question_words: sorted(question_words - common))
+
+
+def load_messages(directory: str = config.TIMES_DIRECTORY) -> pd.DataFrame:
+    """
+    All exported messages as one frame, ordered by conversation and message id.
+    Parquet files are preferred; CSVs are read for runs without a Parquet file.
+    """
+    parquet_paths = sorted(glob.glob(os.path.join(directory, "times_*.parquet")))
+    exported_runs = {path[:-len(".parquet")] for path in parquet_paths}
+    csv_paths = [path for path in sorted(glob.glob(os.path.join(directory, "times_*.csv")))
+                 if path[:-len(".csv")] not in exported_runs]
+    frames = [pd.read_parquet(path) for path in parquet_paths]
+    frames += [pd.read_csv(path, parse_dates=["timestamp"]) for path in csv_paths]
+    if not frames:
+        raise FileNotFoundError(f"No exported times files in {directory}; run export.py first.")
+    messages = pd.concat(frames, ignore_index=True)
+    # --full exports repeat earlier runs
+    messages = messages.drop_duplicates("message_id", keep="last")
+    messages["content"] = messages["content"].fillna("").astype(str)
+    return messages.sort_values(["conversation_id", "message_id"], ignore_index=True)
+
+
+def detect_languages(messages: pd.DataFrame, min_share: float = 0.3, min_turkish_share: float = 0.01) -> pd.Series:
+    """
+    Interview language per conversation ("en", "tr", "ru", or "unknown" if the bot has
+    said nothing after its trilingual opening), from the script of the bot's messages:
+    mostly Cyrillic is Russian, Turkish-only letters mean Turkish.
+    """
+    assistant = messages[messages["sender_role"] == "assistant"]
+    # The first message asks for the language in all three
+    replies = assistant[assistant["conversation_id"].duplicated()]
+    text = replies.groupby("conversation_id")["content"].agg(" ".join)
+    letters = text.str.count(LETTER).clip(lower=1)
+    cyrillic = text.str.count(CYRILLIC) / letters
+    turkish = text.str.count(TURKISH) / letters
+    languages = pd.Series(np.select([cyrillic >= min_share, turkish >= min_turkish_share], ["ru", "tr"], "en"),
+                          index=text.index)
+    return languages.reindex(messages["conversation_id"].unique(), fill_value="unknown").rename("language")
+
+
+def assign_questions(messages: pd.DataFrame, questions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add `language` and `question_order` (the outline question being answered or asked)
+    to `messages`. Interviews not in an outline language get no question_order.
+    """
+    language = messages["conversation_id"].map(detect_languages(messages))
+    in_outline_language = language.isin(OUTLINE_LANGUAGES).to_numpy()
+    is_assistant = ((messages["sender_role"] == "assistant").to_numpy()) & in_outline_language
+    assistant_text = messages.loc[is_assistant, "content"].str.lower()
+
+    # keyword hits: assistant messages x questions
+    keywords = question_keywords(questions)
+    scores = np.zeros((len(assistant_text), len(questions)))
+    for column, words in enumerate(keywords):
+        if words:
+            scores[:, column] = assistant_text.str.count(r"\b(?:" + "|".join(words) + r")\b").to_numpy()
+    # Scored relative to the hits each question needs, so short questions aren't outvoted
+    required = np.maximum(np.minimum(MIN_QUESTION_SCORE, keywords.map(len).to_numpy()), 1)
+    scores = scores / required
+    best = scores.argmax(axis=1)
+    best = np.where(scores[np.arange(len(best)), best] >= 1, best, np.nan)
+
+    asked = pd.Series(np.nan, index=messages.index)
+    asked[is_assistant] = best
+    # Assistant turns before any recognised question are the opening (first outline question)
+    first_assistant = messages.index[is_assistant][~messages.loc[is_assistant, "conversation_id"].duplicated().to_numpy()]
+    asked[first_assistant] = asked[first_assistant].fillna(0)
+
+    # Interviews only move forward: carry the furthest question reached down the conversation,
+    # so follow-ups and probes, and the answers to them, stay with their question
+    conversation = messages["conversation_id"]
+    messages = messages.copy()
+    messages["language"] = language
+    messages["question_order"] = asked.groupby(conversation).ffill().groupby(conversation).cummax().astype("Int64")
+    messages.loc[~in_outline_language, "question_order"] = pd.NA
+    return messages
+
+
+def question_stats(messages: pd.DataFrame, questions: pd.DataFrame) -> pd.DataFrame:
+    answers = messages[(messages["sender_role"] == "user") & messages["question_order"].notna()].assign(
+        answer_words=lambda frame: frame["content"].str.count(r"\S+"),
+        answer_chars=lambda frame: frame["content"].str.len(),
+    )
+    answer_stats = answers.groupby("question_order").agg(
+        answers=("message_id", "size"),
+        conversations=("conversation_id", "nunique"),
+        median_answer_words=("answer_words", "median"),
+        mean_answer_words=("answer_words", "mean"),
+        median_answer_chars=("answer_chars", "median"),
+        median_think_time_seconds=("think_time_seconds", "median"),
+        p90_think_time_seconds=("think_time_seconds", lambda values: values.quantile(0.9)),
+    )
+    bot_latency = messages[messages["sender_role"] == "assistant"].groupby("question_order").agg(
+        median_bot_latency_seconds=("response_latency_seconds", "median"),
+        p90_bot_latency_seconds=("response_latency_seconds", lambda values: values.quantile(0.9)),
+    )
+    stats = questions.set_index("order").join(answer_stats).join(bot_latency)
+    stats[["answers", "conversations"]] = stats[["answers", "conversations"]].fillna(0).astype(int)
+    return stats.reset_index()
+
+
+def completion_funnel(messages: pd.DataFrame, questions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Number and share of conversations reaching each phase of the outline
+    (only interviews in an outline language).
+    """
+    messages = messages[messages["language"].isin(OUTLINE_LANGUAGES)]
+    furthest_order = messages.groupby("conversation_id")["question_order"].max().fillna(0).astype(int)
+    furthest_phase = questions["phase"].to_numpy()[furthest_order.to_numpy()]
+    phases = questions.drop_duplicates("phase")[["phase", "phase_name"]].reset_index(drop=True)
+    reached = (furthest_phase[:, None] >= phases["phase"].to_numpy()[None, :]).sum(axis=0)
+    total = max(len(furthest_order), 1)
+    phases["conversations"] = reached
+    phases["share"] = reached / total
+    phases["drop_off"] = -np.diff(np.concatenate([[len(furthest_order)], reached]))
+    return phases
+
+
+def load_code_dictionary(path: str = None) -> dict:
+    """
+    {code: [terms]} from a JSON file, or from config.ANALYTICS_CODES (`name: term, term` lines).
+    """
+    if path:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    codes = {}
+    for line in config.ANALYTICS_CODES.splitlines():
+        name, separator, terms = line.partition(":")
+        if separator and name.strip():
+            codes[name.strip()] = [term.strip() for term in terms.split(",") if term.strip()]
+    return codes
+
+
+def _term_pattern(term: str) -> str:
+    if term.endswith("*"):
+        return re.escape(term[:-1]) + r"\w*"
+    return re.escape(term) + r"\b"
+
+
+def match_codes(answers: pd.DataFrame, codes: dict) -> pd.DataFrame:
+    """
+    One boolean column per code: whether the answer contains any of its terms.
+    Each code is a single case-insensitive regex run over the whole column.
+    """
+    text = answers["content"]
+    matches = {
+        code: text.str.contains(r"\b(?:" + "|".join(_term_pattern(term) for term in terms) + ")",
+                                case=False, regex=True)
+        for code, terms in codes.items() if terms
+    }
+    return pd.DataFrame(matches, index=answers.index)
+
+
+class BatchLLMCoder:
+    """
+    Codes answers with an LLM through the OpenAI or Anthropic batch API.
+
+    Each answer's result is cached in a JSON Lines file keyed by a hash of the model,
+    code list, question and answer, so re-running only submits new answers. Batch ids
+    still being processed are remembered, so an interrupted run picks them up again.
+    """
+
+    PROMPT = (
+        "You code interview answers for a qualitative study of hospitality workers.\n"
+        "Codes:\n{codes}\n\n"
+        "Question: {question}\nAnswer: {answer}\n\n"
+        "Reply with a JSON array of the codes that apply to the answer (possibly empty) and nothing else."
+    )
+
+    def __init__(self, provider: str, model: str, codes: dict, cache_dir: str,
+                 max_batch: int = 10000, poll_interval: float = 30):
+        self.provider = provider
+        self.model = model
+        self.codes = codes
+        self.max_batch = max_batch
+        self.poll_interval = poll_interval
+        self.cache_path = os.path.join(cache_dir, "llm_coding_cache.jsonl")
+        self.pending_path = os.path.join(cache_dir, "llm_coding_batches.json")
+        self._code_list = "\n".join(f"- {code}: {', '.join(terms)}" for code, terms in codes.items())
+        self._cache = self._load_cache()
+        if provider == "openai":
+            from openai import OpenAI
+            self.client = OpenAI()
+        elif provider == "anthropic":
+            from anthropic import Anthropic
+            self.client = Anthropic()
+        else:
+            raise ValueError(f"Batch coding is not supported for provider '{provider}'")
+
+    def _load_cache(self) -> dict:
+        cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path, encoding="utf-8") as f:
+                for line in f:
+                    entry = json.loads(line)
+                    cache[entry["key"]] = entry["codes"]
+        return cache
+
+    def _store(self, results: dict):
+        with open(self.cache_path, "a", encoding="utf-8") as f:
+            for key, codes in results.items():
+                f.write(json.dumps({"key": key, "codes": codes}, ensure_ascii=False) + "\n")
+        self._cache.update(results)
+
+    def _key(self, question: str, answer: str) -> str:
+        payload = json.dumps([self.provider, self.model, self._code_list, question, answer], ensure_ascii=False)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _parse(self, text: str) -> list:
+        match = re.search(r"\[.*\]", text, re.S)
+        try:
+            codes = json.loads(match.group(0)) if match else []
+        except ValueError:
+            return []
+        return [code for code in codes if code in self.codes]
+
+    def _load_pending(self) -> list:
+        if not os.path.exists(self.pending_path):
+            return []
+        with open(self.pending_path) as f:
+            return json.load(f)
+
+    def _save_pending(self, batch_ids: list):
+        with open(self.pending_path, "w") as f:
+            json.dump(batch_ids, f)
+
+    def code(self, answers: pd.DataFrame) -> pd.Series:
+        """
+        Codes for each answer (a frame with `question_text` and `content`), as lists.
+        """
+        keys = [self._key(question, answer) for question, answer in zip(answers["question_text"], answers["content"])]
+        requests = {}
+        for key, question, answer in zip(keys, answers["question_text"], answers["content"]):
+            if key not in self._cache and key not in requests:
+                requests[key] = self.PROMPT.format(codes=self._code_list, question=question, answer=answer)
+
+        batch_ids = self._load_pending()
+        items = list(requests.items())
+        if items and not batch_ids:
+            for start in range(0, len(items), self.max_batch):
+                batch_ids.append(self._submit(items[start:start + self.max_batch]))
+                self._save_pending(batch_ids)
+            logger.info(f"Submitted {len(items)} answers for LLM coding in {len(batch_ids)} batches")
+        elif batch_ids:
+            logger.info(f"Resuming {len(batch_ids)} LLM coding batches from an earlier run")
+
+        while batch_ids:
+            results = self._collect(batch_ids[0])
+            if results is None:
+                time.sleep(self.poll_interval)
+                continue
+            self._store(results)
+            batch_ids.pop(0)
+            self._save_pending(batch_ids)
+        if items and any(key not in self._cache for key in requests):
+            logger.info("Some answers were not coded by the resumed batches; run again to submit them.")
+        return pd.Series([self._cache.get(key) for key in keys], index=answers.index)
+
+    def _submit(self, items: list) -> str:
+        if self.provider == "openai":
+            lines = [
+                json.dumps({
+                    "custom_id": key,
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": self.model, "temperature": 0,
+                             "messages": [{"role": "user", "content": prompt}]},
+                }, ensure_ascii=False)
+                for key, prompt in items
+            ]
+            batch_file = self.client.files.create(
+                file=("coding.jsonl", "\n".join(lines).encode("utf-8")), purpose="batch"
+            )
+            batch = self.client.batches.create(
+                input_file_id=batch_file.id, endpoint="/v1/chat/completions", completion_window="24h"
+            )
+        else:
+            batch = self.client.messages.batches.create(requests=[
+                {"custom_id": key,
+                 "params": {"model": self.model, "max_tokens": 256, "temperature": 0,
+                            "messages": [{"role": "user", "content": prompt}]}}
+                for key, prompt in items
+            ])
+        return batch.id
+
+    def _collect(self, batch_id: str):
+        """
+        {key: codes} once the batch has finished, or None while it is still running.
+        """
+        results = {}
+        if self.provider == "openai":
+            batch = self.client.batches.retrieve(batch_id)
+            if batch.status in ("validating", "in_progress", "finalizing"):
+                return None
+            if batch.status != "completed" or not batch.output_file_id:
+                logger.error(f"LLM coding batch {batch_id} ended with status {batch.status}")
+                return results
+            for line in self.client.files.content(batch.output_file_id).text.splitlines():
+                entry = json.loads(line)
+                if entry.get("response") and entry["response"]["status_code"] == 200:
+                    text = entry["response"]["body"]["choices"][0]["message"]["content"]
+                    results[entry["custom_id"]] = self._parse(text)
+        else:
+            batch = self.client.messages.batches.retrieve(batch_id)
+            if batch.processing_status != "ended":
+                return None
+            for entry in self.client.messages.batches.results(batch_id):
+                if entry.result.type == "succeeded":
+                    results[entry.custom_id] = self._parse(entry.result.message.content[0].text)
+        return results
+
+
+def analyze(codes_path: str = None, llm_coding: str = None, llm_model: str = None):
+    os.makedirs(config.ANALYTICS_DIRECTORY, exist_ok=True)
+    questions = parse_outline()
+    messages = assign_questions(load_messages(), questions)
+    logger.info(f"Loaded {len(messages)} messages from {messages['conversation_id'].nunique()} conversations")
+
+    def output(frame: pd.DataFrame, name: str):
+        path = os.path.join(config.ANALYTICS_DIRECTORY, name)
+        frame.to_csv(path, index=False)
+        logger.info(f"Wrote {path}")
+
+    output(question_stats(messages, questions), "question_stats.csv")
+    output(completion_funnel(messages, questions), "funnel.csv")
+    languages = messages.drop_duplicates("conversation_id")["language"].value_counts()
+    output(languages.rename_axis("language").reset_index(name="conversations"), "languages.csv")
+    excluded = languages.drop(list(OUTLINE_LANGUAGES), errors="ignore").sum()
+    if excluded:
+        logger.info(f"{excluded} non-English interviews are not mapped to outline questions (see languages.csv)")
+
+    codes = load_code_dictionary(codes_path)
+    if not codes:
+        logger.info("No code dictionary (config.ANALYTICS_CODES is empty and no --codes file given), skipping coding.")
+        return
+    answers = messages[(messages["sender_role"] == "user") & messages["question_order"].notna()]
+    answers = answers.join(
+        questions.set_index("order")[["question_id", "text"]].rename(columns={"text": "question_text"}),
+        on="question_order"
+    )
+    matches = match_codes(answers, codes)
+    coded = pd.concat([answers[["conversation_id", "message_id", "language", "question_id", "content"]], matches], axis=1)
+    output(coded, "codes.csv")
+    output(coded.groupby("question_id", sort=False)[list(matches.columns)].sum().reset_index(), "code_counts.csv")
+
+    if llm_coding:
+        default_model = "gpt-4.1-2025-04-14" if llm_coding == "openai" else "claude-sonnet-4-20250514"
+        coder = BatchLLMCoder(llm_coding, llm_model or default_model, codes, config.ANALYTICS_DIRECTORY)
+        llm_codes = coder.code(answers)
+        output(answers[["conversation_id", "message_id", "question_id"]].assign(
+            codes=llm_codes.map(lambda codes: json.dumps(codes) if codes is not None else None)
+        ), "llm_codes.csv")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Per-question statistics, completion funnel and coding of exported interviews.")
+    parser.add_argument("--codes", help="JSON code dictionary {code: [terms]} (default: config.ANALYTICS_CODES)")
+    parser.add_argument("--llm-coding", choices=["openai", "anthropic"], help="also code answers via this provider's batch API")
+    parser.add_argument("--llm-model", help="model used for LLM coding")
+    args = parser.parse_args()
+    analyze(args.codes, args.llm_coding, args.llm_model)
@@ -0,0 +1,322 @@
+"""
+Archive ended conversations out of the hot tables.
+
+  python archive.py archive [--older-than-days N] [--wave NAME] [--include-unexported]
+  python archive.py verify [ARCHIVE ...]
+  python archive.py restore ARCHIVE [--dry-run]
+
+`archive` moves conversations that ended more than --older-than-days ago (with
+their messages and summaries) into gzip-compressed JSON Lines files, one per
+survey wave, under BACKUPS_DIRECTORY:
+
+  archive_<wave>_<run>.jsonl.gz          one line per conversation
+  archive_<wave>_<run>.manifest.json     counts and SHA-256 of the archive
+
+The wave is the month the conversation started (YYYY-MM) unless --wave is given.
+By default only conversations already exported by export.py are archived. Rows are
+deleted only after the written archive has been read back and verified. Users stay
+in the database.
+
+`restore` verifies an archive and inserts its conversations back with their original
+ids, skipping any that are already present.
+"""
+import os
+import gzip
+import json
+import hashlib
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, delete, and_, or_
+from sqlalchemy.orm import Session
+
+import config
+from database import Conversation, ConversationSummary, Message, User, SessionLocal
+from export import load_state, _isoformat, _naive_utc
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT_VERSION = 1
+
+
+def _parse_datetime(value):
+    return datetime.fromisoformat(value) if value else None
+
+
+def _sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _manifest_path(archive_path: str) -> str:
+    return archive_path[:-len(".jsonl.gz")] + ".manifest.json"
+
+
+def select_archivable(db: Session, ended_before: datetime, exported_up_to=None):
+    """
+    Yield (conversation, telegram_user_id) for conversations ended before `ended_before` (naive UTC).
+    `exported_up_to` is export.py's (ended_at, conversation_id) watermark; if given, only
+    conversations at or before it are returned.
+    """
+    query = (
+        select(Conversation, User.telegram_user_id)
+        .join(User, User.id == Conversation.user_id)
+        .where(Conversation.ended_at != None, Conversation.ended_at < ended_before)
+        .order_by(Conversation.id)
+        .execution_options(yield_per=1000)
+    )
+    if exported_up_to is not None:
+        ended_at, conversation_id = exported_up_to
+        query = query.where(or_(
+            Conversation.ended_at < ended_at,
+            and_(Conversation.ended_at == ended_at, Conversation.id <= conversation_id)
+        ))
+    yield from db.execute(query)
+
+
+def conversation_record(db: Session, conversation: Conversation, telegram_user_id: int) -> dict:
+    messages = db.execute(
+        select(Message.id, Message.sender_role, Message.content, Message.timestamp)
+        .where(Message.conversation_id == conversation.id)
+        .order_by(Message.id)
+    ).all()
+    summary = db.get(ConversationSummary, conversation.id)
+    return {
+        "conversation_id": conversation.id,
+        "telegram_user_id": telegram_user_id,
+        "started_at": _isoformat(conversation.started_at),
+        "ended_at": _isoformat(conversation.ended_at),
+        "summary": {
+            "summary": summary.summary,
+            "summarized_count": summary.summarized_count,
+            "updated_at": _isoformat(summary.updated_at),
+        } if summary else None,
+        "messages": [
+            {"id": message_id, "role": role, "content": content, "timestamp": _isoformat(timestamp)}
+            for message_id, role, content, timestamp in messages
+        ],
+    }
+
+
+class WaveArchiveWriter:
+    """
+    Writes conversation records to one compressed archive per wave.
+    """
+
+    def __init__(self, directory: str, run: str):
+        self.directory = directory
+        self.run = run
+        self._files = {} # wave -> (path, gzip file)
+        self.contents = {} # wave -> {"conversation_ids": [...], "messages": n}
+
+    def write(self, wave: str, record: dict):
+        if wave not in self._files:
+            path = os.path.join(self.directory, f"archive_{wave}_{self.run}.jsonl.gz")
+            self._files[wave] = (path, gzip.open(path, "wt", encoding="utf-8"))
+            self.contents[wave] = {"conversation_ids": [], "messages": 0}
+        self._files[wave][1].write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.contents[wave]["conversation_ids"].append(record["conversation_id"])
+        self.contents[wave]["messages"] += len(record["messages"])
+
+    def close(self):
+        """
+        Close the archives and write their manifests. Returns the archive paths.
+        """
+        paths = []
+        for wave, (path, f) in self._files.items():
+            f.close()
+            with open(path, "rb") as raw:
+                os.fsync(raw.fileno())
+            contents = self.contents[wave]
+            manifest = {
+                "format_version": ARCHIVE_FORMAT_VERSION,
+                "wave": wave,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "conversations": len(contents["conversation_ids"]),
+                "messages": contents["messages"],
+                "conversation_ids": contents["conversation_ids"],
+                "sha256": _sha256(path),
+            }
+            with open(_manifest_path(path), "w") as manifest_file:
+                json.dump(manifest, manifest_file, indent=2)
+            paths.append(path)
+        return paths
+
+
+def read_archive(path: str):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+def verify_archive(path: str):
+    """
+    Check an archive against its manifest: checksum, conversation and message counts.
+    Returns the manifest; raises ValueError if anything doesn't match.
+    """
+    manifest_path = _manifest_path(path)
+    if not os.path.exists(manifest_path):
+        raise ValueError(f"{path}: manifest {manifest_path} is missing")
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if _sha256(path) != manifest["sha256"]:
+        raise ValueError(f"{path}: checksum mismatch")
+    conversation_ids = []
+    messages = 0
+    for record in read_archive(path):
+        conversation_ids.append(record["conversation_id"])
+        messages += len(record["messages"])
+    if conversation_ids != manifest["conversation_ids"] or messages != manifest["messages"]:
+        raise ValueError(
+            f"{path}: contains {len(conversation_ids)} conversations / {messages} messages, "
+            f"manifest says {manifest['conversations']} / {manifest['messages']}"
+        )
+    return manifest
+
+
+def _delete_conversations(db: Session, conversation_ids: list, batch_size: int = 500):
+    for start in range(0, len(conversation_ids), batch_size):
+        ids = conversation_ids[start:start + batch_size]
+        db.execute(delete(Message).where(Message.conversation_id.in_(ids)))
+        db.execute(delete(ConversationSummary).where(ConversationSummary.conversation_id.in_(ids)))
+        db.execute(delete(Conversation).where(Conversation.id.in_(ids)))
+        db.commit()
+
+
+def archive(older_than_days: float = 30, wave: str = None, include_unexported: bool = False):
+    os.makedirs(config.BACKUPS_DIRECTORY, exist_ok=True)
+
+    # Timestamps are stored as naive UTC
+    ended_before = _naive_utc(datetime.now(timezone.utc) - timedelta(days=older_than_days))
+    exported_up_to = None
+    if not include_unexported:
+        # Don't take conversations away from the next incremental export
+        state = load_state()
+        if state is None:
+            logger.info("Nothing has been exported yet (run export.py first, or use --include-unexported).")
+            return []
+        exported_up_to = (_naive_utc(datetime.fromisoformat(state["ended_at"])), state["conversation_id"])
+
+    run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    writer = WaveArchiveWriter(config.BACKUPS_DIRECTORY, run)
+    db: Session = SessionLocal()
+    try:
+        try:
+            for conversation, telegram_user_id in select_archivable(db, ended_before, exported_up_to):
+                record = conversation_record(db, conversation, telegram_user_id)
+                started_at = conversation.started_at
+                writer.write(wave or (started_at.strftime("%Y-%m") if started_at else "unknown"), record)
+        finally:
+            paths = writer.close()
+
+        for path in paths:
+            manifest = verify_archive(path)
+            _delete_conversations(db, manifest["conversation_ids"])
+            logger.info(
+                f"Archived {manifest['conversations']} conversations ({manifest['messages']} messages) "
+                f"of wave {manifest['wave']} to {path}"
+            )
+    finally:
+        db.close()
+
+    if not paths:
+        logger.info("No ended conversations to archive.")
+    return paths
+
+
+def restore(path: str, dry_run: bool = False):
+    manifest = verify_archive(path)
+    restored = 0
+    skipped = 0
+    db: Session = SessionLocal()
+    try:
+        user_ids = {}
+        for record in read_archive(path):
+            if db.get(Conversation, record["conversation_id"]) is not None:
+                skipped += 1
+                continue
+            telegram_user_id = record["telegram_user_id"]
+            if telegram_user_id not in user_ids:
+                user = db.execute(select(User).where(User.telegram_user_id == telegram_user_id)).scalar_one_or_none()
+                if user is None:
+                    user = User(telegram_user_id=telegram_user_id)
+                    db.add(user)
+                    db.flush()
+                user_ids[telegram_user_id] = user.id
+            db.add(Conversation(
+                id=record["conversation_id"],
+                user_id=user_ids[telegram_user_id],
+                started_at=_parse_datetime(record["started_at"]),
+                ended_at=_parse_datetime(record["ended_at"]),
+            ))
+            db.flush()
+            db.add_all([
+                Message(
+                    id=message["id"],
+                    conversation_id=record["conversation_id"],
+                    sender_role=message["role"],
+                    content=message["content"],
+                    timestamp=_parse_datetime(message["timestamp"]),
+                )
+                for message in record["messages"]
+            ])
+            if record["summary"]:
+                db.add(ConversationSummary(
+                    conversation_id=record["conversation_id"],
+                    summary=record["summary"]["summary"],
+                    summarized_count=record["summary"]["summarized_count"],
+                    updated_at=_parse_datetime(record["summary"]["updated_at"]),
+                ))
+            restored += 1
+        if dry_run:
+            db.rollback()
+        else:
+            db.commit()
+    finally:
+        db.close()
+
+    action = "Would restore" if dry_run else "Restored"
+    logger.info(f"{action} {restored} of {manifest['conversations']} conversations from {path} ({skipped} already present)")
+    return restored
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Archive, verify and restore ended conversations.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = commands.add_parser("archive", help="move ended conversations into per-wave archives")
+    archive_parser.add_argument("--older-than-days", type=float, default=30, help="only conversations ended this long ago")
+    archive_parser.add_argument("--wave", help="wave name for all archived conversations (default: start month)")
+    archive_parser.add_argument("--include-unexported", action="store_true",
+                                help="also archive conversations export.py hasn't exported yet")
+
+    verify_parser = commands.add_parser("verify", help="check archives against their manifests")
+    verify_parser.add_argument("archives", nargs="*", help="default: every archive in BACKUPS_DIRECTORY")
+
+    restore_parser = commands.add_parser("restore", help="put an archive's conversations back into the database")
+    restore_parser.add_argument("archive")
+    restore_parser.add_argument("--dry-run", action="store_true", help="check the restore without committing")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        archive(args.older_than_days, args.wave, args.include_unexported)
+    elif args.command == "verify":
+        archives = args.archives or sorted(
+            os.path.join(config.BACKUPS_DIRECTORY, name) for name in os.listdir(config.BACKUPS_DIRECTORY)
+            if name.endswith(".jsonl.gz")
+        )
+        failed = 0
+        for path in archives:
+            try:
+                manifest = verify_archive(path)
+                logger.info(f"OK {path}: {manifest['conversations']} conversations, {manifest['messages']} messages")
+            except ValueError as e:
+                logger.error(str(e))
+                failed += 1
+        exit(1 if failed else 0)
+    else:
+        restore(args.archive, dry_run=args.dry_run)
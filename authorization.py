@@ -0,0 +1,154 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from sqlalchemy import select
+
+from database import AuthorizedUser
+
+logger = logging.getLogger(__name__)
+
+
+class UserLookupCache:
+    """
+    Maps a Telegram user id to (user id, open conversation id) so returning users
+    don't need a database lookup on every message.
+
+    Entries must be invalidated whenever the open conversation changes (/start,
+    end of interview). They are evicted least-recently-used once `max_entries` is
+    exceeded and expire `ttl_seconds` after they were last touched.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # telegram_user_id -> (last_access, user_id, conversation_id)
+
+    def get(self, telegram_user_id: int):
+        """
+        Return (user_id, conversation_id), or None on a miss or expired entry.
+        """
+        entry = self._entries.get(telegram_user_id)
+        if entry is None:
+            return None
+        last_access, user_id, conversation_id = entry
+        now = time.monotonic()
+        if now - last_access > self.ttl_seconds:
+            del self._entries[telegram_user_id]
+            return None
+        self._entries[telegram_user_id] = (now, user_id, conversation_id)
+        self._entries.move_to_end(telegram_user_id)
+        return user_id, conversation_id
+
+    def set(self, telegram_user_id: int, user_id: int, conversation_id: int):
+        self._entries[telegram_user_id] = (time.monotonic(), user_id, conversation_id)
+        self._entries.move_to_end(telegram_user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_user_id: int):
+        self._entries.pop(telegram_user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Allowlist:
+    """
+    Telegram user ids allowed to use the bot, loaded from a file (one id per line,
+    `#` starts a comment) and/or the authorized_users table, and reloaded every
+    `reload_interval` seconds while running. The file is only re-read when it changed.
+
+    Without a source everyone is let in. With one, only the loaded ids are: until the
+    first load succeeds nobody is, and `start` raises if it fails. Lines of the file
+    that aren't ids are skipped with a warning. If a later reload fails the previous
+    ids are kept.
+    """
+
+    def __init__(self, path: str = None, session_factory=None, reload_interval: float = 30):
+        self.path = path
+        self.session_factory = session_factory
+        self.reload_interval = reload_interval
+        self._ids = frozenset()
+        self._file_ids = frozenset()
+        self._file_mtime = None
+        self._loaded = False
+        self._task = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.path is not None or self.session_factory is not None
+
+    def is_allowed(self, telegram_user_id: int) -> bool:
+        if not self.enabled:
+            return True
+        return telegram_user_id in self._ids
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _read_file(self):
+        mtime = os.stat(self.path).st_mtime
+        if mtime == self._file_mtime:
+            return self._file_ids
+        ids = set()
+        with open(self.path) as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                try:
+                    ids.add(int(line))
+                except ValueError:
+                    logger.warning(f"{self.path}:{line_number}: skipping invalid user id {line!r}")
+        self._file_ids = frozenset(ids)
+        self._file_mtime = mtime
+        return self._file_ids
+
+    async def _read_db(self):
+        async with self.session_factory() as db:
+            result = await db.execute(select(AuthorizedUser.telegram_user_id))
+            return frozenset(result.scalars())
+
+    async def reload(self):
+        """
+        Re-read the sources. Raises if they can't be read and nothing was loaded yet.
+        """
+        try:
+            ids = set()
+            if self.path is not None:
+                ids |= await asyncio.to_thread(self._read_file)
+            if self.session_factory is not None:
+                ids |= await self._read_db()
+        except Exception as e:
+            if not self._loaded:
+                raise
+            logger.error(f"Could not reload the allowlist, keeping {len(self._ids)} ids: {e}")
+            return
+        if ids != self._ids or not self._loaded:
+            logger.info(f"Allowlist loaded: {len(ids)} authorized users")
+            if not ids:
+                logger.warning("The allowlist is empty: nobody can use the bot")
+        self._ids = frozenset(ids)
+        self._loaded = True
+
+    async def start(self):
+        if not self.enabled:
+            return
+        await self.reload()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            await self.reload()
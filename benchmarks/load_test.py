@@ -0,0 +1,305 @@
+"""
+Load test for the interview bot.
+
+Drives the real Application handlers (through the configured update processor) with
+synthetic Telegram updates for N simulated respondents who follow the
+INTERVIEW_OUTLINE flow, against the local mock LLM server. Telegram API calls are
+answered in-process. Reports turn latency percentiles, throughput, database query
+counts and event-loop lag.
+
+Usage (from the repository root):
+    python -m benchmarks.load_test --respondents 50 --latency lognormal:1.5,0.5
+    python -m benchmarks.load_test --respondents 200 --provider anthropic --stream --json bench.json
+
+Any other bot setting (CONTEXT_TOKEN_BUDGET, MESSAGE_WRITE_BEHIND, ...) is read from
+the environment as usual.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+import tempfile
+import statistics
+
+from benchmarks.mock_llm_server import MockLLMServer
+
+# Answers of a simulated respondent, in interview order
+ANSWERS = [
+    "English",
+    "Yes, I'm ready.",
+    "I'm a receptionist in the front office department.",
+    "About three years now.",
+    "I finished high school and did a tourism course.",
+    "I'm 29, female.",
+    "Last month a guest wrote a review mentioning me by name.",
+    "Stable income and meeting people from all over the world.",
+    "My manager is supportive but some guests can be rude.",
+    "Not much, the procedures are strict.",
+    "Solving problems for guests, every day is different.",
+    "My supervisor tells me, sometimes guests thank me.",
+    "We have some trainings but not many.",
+    "When I help someone who is really stressed.",
+    "Understaffing during the high season.",
+    "Sometimes, in our weekly meetings.",
+    "It was easier than I expected.",
+    "Yes, I would.",
+    "No, I think we covered everything.",
+    "Yes, that's a fair summary.",
+]
+
+
+def percentile(values: list, p: float):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def configure_environment(args, database_url: str):
+    # Must happen before `main` is imported: it reads its settings at import time
+    os.environ["TELEGRAM_BOT_TOKEN"] = "123456:LOADTEST"
+    os.environ["DATABASE_URL"] = database_url
+    os.environ.pop("WEBHOOK_URL", None)
+    os.environ["STREAM_RESPONSES"] = "true" if args.stream else "false"
+    os.environ["STREAM_EDIT_INTERVAL_SECONDS"] = str(args.edit_interval)
+    os.environ.setdefault("LLM_REQUESTS_PER_SECOND", "1000")
+    os.environ.setdefault("LLM_MAX_CONCURRENCY", str(max(16, args.respondents)))
+    os.environ.setdefault("CONCURRENT_UPDATES", str(max(64, args.respondents)))
+    for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "AZURE_OPENAI_API_KEY"):
+        os.environ.pop(key, None)
+    base_url = f"http://127.0.0.1:{args.port}"
+    if args.provider == "anthropic":
+        os.environ["ANTHROPIC_API_KEY"] = "loadtest"
+        os.environ["ANTHROPIC_BASE_URL"] = base_url
+        os.environ["LLM_PROVIDERS"] = "anthropic"
+    else:
+        os.environ["OPENAI_API_KEY"] = "loadtest"
+        os.environ["OPENAI_BASE_URL"] = f"{base_url}/v1"
+        os.environ["LLM_PROVIDERS"] = "openai"
+
+
+def make_fake_telegram_request(latency: float):
+    """
+    A telegram.request.BaseRequest that answers Bot API calls locally, after `latency` seconds.
+    """
+    from telegram.request import BaseRequest
+
+    class FakeTelegramRequest(BaseRequest):
+        def __init__(self):
+            self.calls = {}
+            self.last_text = {}
+            self._message_id = 0
+
+        @property
+        def read_timeout(self):
+            return 5.0
+
+        async def initialize(self):
+            pass
+
+        async def shutdown(self):
+            pass
+
+        async def do_request(self, url, method, request_data=None, read_timeout=None,
+                             write_timeout=None, connect_timeout=None, pool_timeout=None):
+            endpoint = url.rsplit("/", 1)[-1]
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            params = request_data.parameters if request_data else {}
+            if latency:
+                await asyncio.sleep(latency)
+
+            if endpoint == "getMe":
+                result = {"id": 123456, "is_bot": True, "first_name": "Survey", "username": "survey_bot"}
+            elif endpoint in ("sendMessage", "editMessageText"):
+                chat_id = int(params["chat_id"])
+                self.last_text[chat_id] = params["text"]
+                if endpoint == "sendMessage":
+                    self._message_id += 1
+                message_id = int(params.get("message_id", self._message_id))
+                result = {"message_id": message_id, "date": int(time.time()),
+                          "chat": {"id": chat_id, "type": "private"}, "text": params["text"]}
+            else:
+                result = True
+            return 200, json.dumps({"ok": True, "result": result}).encode()
+
+    return FakeTelegramRequest()
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late a periodic timer fires; a blocked event loop shows up as lag.
+    """
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+async def run_load_test(args):
+    database_path = os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "bot.db")
+    configure_environment(args, args.database_url or f"sqlite:///{database_path}")
+
+    mock_server = MockLLMServer(args.latency, interview_length=len(ANSWERS))
+    await mock_server.start(port=args.port)
+
+    from telegram import Update
+    from sqlalchemy import event
+    import config
+    import database
+    import main
+
+    logging.getLogger().setLevel(logging.WARNING)
+    database.create_db_and_tables()
+
+    query_count = 0
+
+    def count_query(*_):
+        nonlocal query_count
+        query_count += 1
+
+    event.listen(database.async_engine.sync_engine, "before_cursor_execute", count_query)
+
+    telegram_request = make_fake_telegram_request(args.telegram_latency)
+    application = main.build_application(request=telegram_request)
+    await application.initialize()
+    await main.post_init(application)
+
+    closing_messages = list(config.CLOSING_MESSAGES.values())
+    turn_latencies = []
+    completed = 0
+    errors = 0
+    update_id = 0
+
+    def make_update(user_id: int, text: str):
+        nonlocal update_id
+        update_id += 1
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"Respondent{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+        return Update.de_json({"update_id": update_id, "message": message}, application.bot)
+
+    async def send(user_id: int, text: str) -> float:
+        update = make_update(user_id, text)
+        started = time.perf_counter()
+        await application.update_processor.process_update(update, application.process_update(update))
+        return time.perf_counter() - started
+
+    async def respondent(user_id: int):
+        nonlocal completed, errors
+        await asyncio.sleep(random.uniform(0, args.ramp_up))
+        await send(user_id, "/start")
+        for answer in ANSWERS:
+            if args.think_time:
+                await asyncio.sleep(random.uniform(0, args.think_time))
+            turn_latencies.append(await send(user_id, answer))
+            reply = telegram_request.last_text.get(user_id, "")
+            if reply.startswith("Sorry"):
+                errors += 1
+            if any(closing in reply for closing in closing_messages):
+                completed += 1
+                return
+
+    lag_monitor = EventLoopLagMonitor()
+    lag_monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(respondent(1000 + i) for i in range(args.respondents)))
+    elapsed = time.perf_counter() - started
+    await lag_monitor.stop()
+
+    await main.post_shutdown(application)
+    await application.shutdown()
+    await mock_server.stop()
+
+    report = {
+        "respondents": args.respondents,
+        "completed_interviews": completed,
+        "error_replies": errors,
+        "turns": len(turn_latencies),
+        "elapsed_seconds": round(elapsed, 2),
+        "throughput_turns_per_second": round(len(turn_latencies) / elapsed, 2) if elapsed else None,
+        "turn_latency_seconds": {
+            "p50": percentile(turn_latencies, 50),
+            "p95": percentile(turn_latencies, 95),
+            "p99": percentile(turn_latencies, 99),
+            "max": max(turn_latencies) if turn_latencies else None,
+        },
+        "db_queries": query_count,
+        "db_queries_per_turn": round(query_count / len(turn_latencies), 2) if turn_latencies else None,
+        "llm_requests": mock_server.requests,
+        "telegram_calls": telegram_request.calls,
+        "event_loop_lag_seconds": {
+            "mean": statistics.fmean(lag_monitor.samples) if lag_monitor.samples else None,
+            "p99": percentile(lag_monitor.samples, 99),
+            "max": max(lag_monitor.samples) if lag_monitor.samples else None,
+        },
+    }
+    return report
+
+
+def print_report(report: dict):
+    latency = report["turn_latency_seconds"]
+    lag = report["event_loop_lag_seconds"]
+    print(f"Respondents:          {report['respondents']} ({report['completed_interviews']} completed, "
+          f"{report['error_replies']} error replies)")
+    print(f"Turns:                {report['turns']} in {report['elapsed_seconds']}s "
+          f"({report['throughput_turns_per_second']} turns/s)")
+    print(f"Turn latency:         p50 {latency['p50']:.3f}s  p95 {latency['p95']:.3f}s  "
+          f"p99 {latency['p99']:.3f}s  max {latency['max']:.3f}s")
+    print(f"DB queries:           {report['db_queries']} ({report['db_queries_per_turn']} per turn)")
+    print(f"LLM requests:         {report['llm_requests']}")
+    print(f"Telegram calls:       {report['telegram_calls']}")
+    print(f"Event loop lag:       mean {lag['mean'] * 1000:.1f}ms  p99 {lag['p99'] * 1000:.1f}ms  "
+          f"max {lag['max'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the interview bot against a mock LLM server.")
+    parser.add_argument("--respondents", type=int, default=20, help="number of simulated respondents")
+    parser.add_argument("--provider", choices=["openai", "anthropic"], default="openai")
+    parser.add_argument("--latency", default="lognormal:1.0,0.4",
+                        help="LLM latency: fixed:S, uniform:LOW,HIGH or lognormal:MEDIAN,SIGMA")
+    parser.add_argument("--stream", action="store_true", help="enable streaming replies")
+    parser.add_argument("--edit-interval", type=float, default=1.5, help="seconds between streamed edits")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Telegram API call")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max seconds a respondent waits before answering")
+    parser.add_argument("--ramp-up", type=float, default=1.0, help="seconds over which respondents start")
+    parser.add_argument("--port", type=int, default=8089, help="port of the mock LLM server")
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(1 if report["error_replies"] else 0)
@@ -0,0 +1,166 @@
+"""
+Local mock of the OpenAI chat completions and Anthropic messages APIs for load tests.
+
+Replies follow the interview: after `interview_length` assistant turns the reply
+ends with the x7x end code. Response time is drawn from a configurable distribution:
+  fixed:SECONDS | uniform:LOW,HIGH | lognormal:MEDIAN,SIGMA
+Streaming responses send the reply in chunks spread over that time.
+
+Standalone: python -m benchmarks.mock_llm_server --port 8089 --latency lognormal:1.5,0.5
+then point OPENAI_BASE_URL=http://127.0.0.1:8089/v1 or ANTHROPIC_BASE_URL=http://127.0.0.1:8089 at it.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from aiohttp import web
+
+REPLY_WORDS = (
+    "Thank you for sharing that with me. Could you tell me a little more about what "
+    "that was like for you and how it affected your day at work?"
+).split()
+
+
+def parse_latency(spec: str):
+    """
+    Return a function producing one latency sample (seconds) for `spec`.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+class MockLLMServer:
+    def __init__(self, latency: str = "lognormal:1.0,0.4", interview_length: int = 20, chunks: int = 10):
+        self.sample_latency = parse_latency(latency)
+        self.interview_length = interview_length
+        self.chunks = chunks
+        self.requests = 0
+        self._runner = None
+
+    def _reply_text(self, messages: list) -> str:
+        assistant_turns = sum(1 for m in messages if m.get("role") == "assistant")
+        if assistant_turns + 1 >= self.interview_length:
+            return "Thank you so much for your time and openness today. x7x"
+        return " ".join(REPLY_WORDS)
+
+    def _chunks(self, text: str):
+        words = text.split(" ")
+        size = max(1, math.ceil(len(words) / self.chunks))
+        for i in range(0, len(words), size):
+            yield " ".join(words[i:i + size]) + (" " if i + size < len(words) else "")
+
+    @staticmethod
+    def _usage(messages: list, text: str):
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages) // 4
+        return prompt_tokens, len(text) // 4
+
+    async def openai_chat_completions(self, request: web.Request):
+        self.requests += 1
+        body = await request.json()
+        messages = body["messages"]
+        text = self._reply_text(messages)
+        latency = self.sample_latency()
+        prompt_tokens, completion_tokens = self._usage(messages, text)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens,
+                 "prompt_tokens_details": {"cached_tokens": 0}}
+        base = {"id": f"chatcmpl-{self.requests}", "created": int(time.time()), "model": body["model"]}
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return web.json_response({
+                **base, "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        parts = list(self._chunks(text))
+        for part in parts:
+            await asyncio.sleep(latency / len(parts))
+            chunk = {**base, "object": "chat.completion.chunk",
+                     "choices": [{"index": 0, "delta": {"content": part}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        final = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+        await response.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode())
+        await response.write_eof()
+        return response
+
+    async def anthropic_messages(self, request: web.Request):
+        self.requests += 1
+        body = await request.json()
+        messages = body["messages"]
+        text = self._reply_text(messages)
+        latency = self.sample_latency()
+        input_tokens, output_tokens = self._usage(messages, text)
+        usage = {"input_tokens": input_tokens, "output_tokens": output_tokens,
+                 "cache_read_input_tokens": 0, "cache_creation_input_tokens": 0}
+        message = {"id": f"msg_{self.requests}", "type": "message", "role": "assistant",
+                   "model": body["model"], "stop_sequence": None}
+
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return web.json_response({**message, "content": [{"type": "text", "text": text}],
+                                      "stop_reason": "end_turn", "usage": usage})
+
+        def event(name, data):
+            return f"event: {name}\ndata: {json.dumps({'type': name, **data})}\n\n".encode()
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(event("message_start", {"message": {
+            **message, "content": [], "stop_reason": None, "usage": {**usage, "output_tokens": 0}}}))
+        await response.write(event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}}))
+        parts = list(self._chunks(text))
+        for part in parts:
+            await asyncio.sleep(latency / len(parts))
+            await response.write(event("content_block_delta", {"index": 0, "delta": {"type": "text_delta", "text": part}}))
+        await response.write(event("content_block_stop", {"index": 0}))
+        await response.write(event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                                     "usage": {"output_tokens": output_tokens}}))
+        await response.write(event("message_stop", {}))
+        await response.write_eof()
+        return response
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.openai_chat_completions)
+        app.router.add_post("/v1/messages", self.anthropic_messages)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8089):
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+
+async def _serve(args):
+    server = MockLLMServer(args.latency, args.interview_length)
+    await server.start(args.host, args.port)
+    print(f"Mock LLM server on http://{args.host}:{args.port} (latency {args.latency})")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI/Anthropic API server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", default="lognormal:1.0,0.4")
+    parser.add_argument("--interview-length", type=int, default=20)
+    asyncio.run(_serve(parser.parse_args()))
@@ -0,0 +1,147 @@
+"""
+Startup-time benchmark for the interview bot.
+
+Starts fresh interpreters that import `main` and build the Application, with a
+given set of providers configured, and reports how long that takes: process
+start to ready, `import main`, and `build_application()`. Also lists which
+provider SDKs got loaded and, with --top, the slowest imports (from -X importtime).
+
+Usage (from the repository root):
+    python -m benchmarks.startup_time --runs 10
+    python -m benchmarks.startup_time --providers openai,anthropic --top 15 --json startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+from benchmarks.load_test import percentile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter; prints one JSON line with its timings
+CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.build_application()
+built = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "build_seconds": built - imported,
+    "sdks": [name for name in ("openai", "anthropic", "tiktoken", "pandas", "pyarrow") if name in sys.modules],
+}))
+"""
+
+PROVIDER_ENV = {
+    "openai": {"OPENAI_API_KEY": "startup-test"},
+    "anthropic": {"ANTHROPIC_API_KEY": "startup-test"},
+    "azure": {
+        "AZURE_OPENAI_API_KEY": "startup-test",
+        "AZURE_OPENAI_ENDPOINT_URL": "https://example.openai.azure.com",
+        "AZURE_OPENAI_API_VERSION": "2024-10-21",
+        "AZURE_OPENAI_DEPLOYMENT_NAME": "startup-test",
+    },
+}
+
+
+def child_environment(providers: list, database_url: str) -> dict:
+    env = {
+        key: value for key, value in os.environ.items()
+        if not key.startswith(("OPENAI_", "ANTHROPIC_", "AZURE_OPENAI_", "WEBHOOK_"))
+    }
+    env["TELEGRAM_BOT_TOKEN"] = "123456:STARTUP"
+    env["DATABASE_URL"] = database_url
+    env["LLM_PROVIDERS"] = ",".join(providers)
+    env["PYTHONPATH"] = REPO_ROOT
+    for provider in providers:
+        env.update(PROVIDER_ENV[provider])
+    return env
+
+
+def parse_importtime(stderr: str, top: int):
+    """
+    The `top` imports with the highest cumulative time, as (module, seconds).
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((module.strip(), int(cumulative) / 1e6))
+    imports.sort(key=lambda item: item[1], reverse=True)
+    return imports[:top]
+
+
+def run_once(env: dict, top: int):
+    command = [sys.executable]
+    if top:
+        command += ["-X", "importtime"]
+    command += ["-c", CHILD_SCRIPT]
+    started = time.perf_counter()
+    result = subprocess.run(command, env=env, cwd=tempfile.gettempdir(), capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        raise RuntimeError(f"Bot failed to start:\n{result.stderr[-2000:]}")
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["process_seconds"] = elapsed
+    if top:
+        timings["slowest_imports"] = parse_importtime(result.stderr, top)
+    return timings
+
+
+def run_startup_benchmark(args):
+    providers = [name.strip() for name in args.providers.split(",") if name.strip()]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = child_environment(providers, f"sqlite:///{os.path.join(tmp_dir, 'startup.db')}")
+        run_once(env, 0) # warm the filesystem cache and bytecode
+        runs = [run_once(env, 0) for _ in range(args.runs)]
+        # -X importtime slows imports down, so it gets a run of its own
+        slowest_imports = run_once(env, args.top)["slowest_imports"] if args.top else []
+
+    def stats(key):
+        values = [run[key] for run in runs]
+        return {"median": statistics.median(values), "p90": percentile(values, 90), "min": min(values)}
+
+    return {
+        "providers": providers,
+        "runs": args.runs,
+        "process_seconds": stats("process_seconds"),
+        "import_seconds": stats("import_seconds"),
+        "build_seconds": stats("build_seconds"),
+        "loaded_sdks": runs[0]["sdks"],
+        "slowest_imports": slowest_imports,
+    }
+
+
+def print_report(report: dict):
+    print(f"Providers:            {','.join(report['providers'])} ({report['runs']} runs)")
+    for key, label in (("process_seconds", "Process to ready:"), ("import_seconds", "import main:"),
+                       ("build_seconds", "build_application:")):
+        value = report[key]
+        print(f"{label:<22}median {value['median']:.3f}s  p90 {value['p90']:.3f}s  min {value['min']:.3f}s")
+    print(f"Loaded SDKs:          {', '.join(report['loaded_sdks']) or '-'}")
+    if report["slowest_imports"]:
+        print("Slowest imports (cumulative):")
+        for module, seconds in report["slowest_imports"]:
+            print(f"  {seconds:7.3f}s  {module}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure how long the bot takes to start.")
+    parser.add_argument("--runs", type=int, default=5, help="number of measured starts")
+    parser.add_argument("--providers", default="openai", help="comma-separated providers to configure")
+    parser.add_argument("--top", type=int, default=0, help="also list the N slowest imports")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+
+    report = run_startup_benchmark(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
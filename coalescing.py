@@ -0,0 +1,128 @@
+import time
+import asyncio
+import logging
+from telegram import Update
+from telegram.ext import filters
+
+logger = logging.getLogger(__name__)
+
+# The updates handle_message receives; only those are registered
+COALESCED_MESSAGES = filters.TEXT & ~filters.COMMAND
+
+
+class MessageCoalescer:
+    """
+    Merges a respondent's rapid consecutive messages into one turn.
+
+    Text messages are registered by the update processor as soon as they arrive,
+    before waiting for the user's lock. The handler of the first of them then waits
+    until no new message has arrived for `window` seconds and takes all pending
+    texts; the handlers of the merged messages find theirs already taken and do nothing.
+
+    At most `max_pending` messages are held per chat; further ones are dropped and
+    counted, and `take_dropped` tells the next turn how many were lost.
+
+    Usage:
+        messages = await coalescer.collect(chat_id, message_id, text)
+        if messages is None:
+            return  # merged into an earlier turn
+    """
+
+    def __init__(self, window: float = 1.0, max_pending: int = 10):
+        self.window = window
+        self.max_pending = max_pending
+        self._pending = {} # chat_id -> list of (message_id, text)
+        self._last_arrival = {} # chat_id -> monotonic time of the newest pending message
+        self._arrival_waiters = {} # chat_id -> future resolved when a message arrives
+        self._taken = {} # chat_id -> ids of messages answered by an earlier turn
+        self._dropped = {} # chat_id -> messages dropped since the last turn
+
+    @staticmethod
+    def _key_for(update: object):
+        if isinstance(update, Update) and update.message and COALESCED_MESSAGES.check_update(update):
+            return update.message.chat_id
+        return None
+
+    def add(self, update: object) -> bool:
+        """
+        Register an incoming update. Returns False if it must be dropped because
+        too many messages from that chat are already waiting.
+        """
+        chat_id = self._key_for(update)
+        if chat_id is None:
+            return True
+        pending = self._pending.setdefault(chat_id, [])
+        if len(pending) >= self.max_pending:
+            dropped = self._dropped[chat_id] = self._dropped.get(chat_id, 0) + 1
+            if dropped == 1:
+                logger.warning(f"Dropping messages from chat {chat_id}: {len(pending)} messages already waiting")
+            return False
+        pending.append((update.message.message_id, update.message.text))
+        self._last_arrival[chat_id] = time.monotonic()
+        waiter = self._arrival_waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+        return True
+
+    async def collect(self, chat_id: int, message_id: int, text: str):
+        """
+        Wait for the debounce window, then take all pending messages of the chat
+        as a list of texts. Returns None if `message_id` was already taken by an
+        earlier turn; a message that was never registered is answered on its own.
+        """
+        taken = self._taken.get(chat_id)
+        if taken is not None and message_id in taken:
+            taken.discard(message_id)
+            if not taken:
+                del self._taken[chat_id]
+            return None
+        pending = self._pending.get(chat_id)
+        if pending is None or all(pending_id != message_id for pending_id, _ in pending):
+            return [text]
+        while True:
+            remaining = self._last_arrival[chat_id] + self.window - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+        del self._last_arrival[chat_id]
+        pending = self._pending.pop(chat_id)
+        # Their own handlers are still to come and must not answer them again
+        others = {pending_id for pending_id, _ in pending if pending_id is not None and pending_id != message_id}
+        if others:
+            self._taken.setdefault(chat_id, set()).update(others)
+        return [text for _, text in pending]
+
+    def take_dropped(self, chat_id: int) -> int:
+        """
+        Number of the chat's messages dropped since the last call.
+        """
+        return self._dropped.pop(chat_id, 0)
+
+    def requeue(self, chat_id: int, messages: list):
+        """
+        Put taken messages back in front of the queue because their turn was
+        abandoned; the turn of the next pending message answers them all together.
+        """
+        pending = self._pending.setdefault(chat_id, [])
+        pending[:0] = [(None, text) for text in messages]
+        self._last_arrival.setdefault(chat_id, time.monotonic())
+
+    async def wait_for_message(self, chat_id: int):
+        """
+        Return once a new message from the chat is pending.
+        """
+        if self._pending.get(chat_id):
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._arrival_waiters[chat_id] = waiter
+        try:
+            await waiter
+        finally:
+            if self._arrival_waiters.get(chat_id) is waiter:
+                del self._arrival_waiters[chat_id]
+
+    def discard(self, chat_id: int):
+        self._pending.pop(chat_id, None)
+        self._last_arrival.pop(chat_id, None)
+        self._taken.pop(chat_id, None)
+        self._dropped.pop(chat_id, None)
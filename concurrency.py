@@ -0,0 +1,104 @@
+import asyncio
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class PostgresChatLock:
+    """
+    Cross-process per-user lock built on Postgres transaction-level advisory locks,
+    so that when several webhook workers run, a conversation is only ever handled by
+    one of them at a time. Each held lock keeps one pooled connection busy, so `engine`
+    should be a dedicated one (see database.create_lock_engine), not the handlers' engine.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    @asynccontextmanager
+    async def __call__(self, key: int):
+        async with self.engine.connect() as connection:
+            async with connection.begin():
+                await connection.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": key})
+                yield
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates concurrently across users, but strictly in arrival
+    order for any single user, so one respondent's answers never overtake
+    each other while other interviews keep running.
+
+    `shared_lock`, if given, is called with the user id and must return an async
+    context manager; it extends the ordering guarantee across worker processes.
+
+    `coalescer`, if given, is a MessageCoalescer that sees every update on arrival,
+    before it waits for the user's lock, and may reject it.
+
+    At most `max_concurrent_updates` updates are processed at once. The limit is applied
+    here, after the user's lock is taken, rather than by the base class before
+    `do_process_update`: otherwise updates queued behind their user's earlier ones would
+    each hold a slot while waiting and could stall every other respondent.
+    """
+
+    # The base class's own limit, effectively disabled
+    UNBOUNDED = 1 << 30
+
+    def __init__(self, max_concurrent_updates: int, shared_lock=None, coalescer=None):
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        super().__init__(self.UNBOUNDED)
+        self.shared_lock = shared_lock
+        self.coalescer = coalescer
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks = {}
+        self._waiters = {}
+
+    async def _process(self, key, coroutine):
+        # The shared lock is taken inside the slot, so at most max_concurrent_updates
+        # of them are held (see database.create_lock_engine)
+        async with self._slots:
+            if key is None or self.shared_lock is None:
+                await coroutine
+            else:
+                async with self.shared_lock(key):
+                    await coroutine
+
+    @staticmethod
+    def _key_for(update: object):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self.coalescer is not None and not self.coalescer.add(update):
+            coroutine.close()
+            return
+
+        key = self._key_for(update)
+        if key is None:
+            await self._process(None, coroutine)
+            return
+
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                await self._process(key, coroutine)
+        finally:
+            # Drop the lock once nobody is waiting on it so the dict doesn't grow forever
+            self._waiters[key] -= 1
+            if self._waiters[key] == 0:
+                del self._waiters[key]
+                del self._locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._locks.clear()
+        self._waiters.clear()
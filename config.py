@@ -149,3 +149,8 @@ CLOSING_MESSAGES["x7x"] = "Thank you for participating, the interview concludes
 TRANSCRIPTS_DIRECTORY = "../data/transcripts/"
 TIMES_DIRECTORY = "../data/times/"
 BACKUPS_DIRECTORY = "../data/backups/"
+ANALYTICS_DIRECTORY = "../data/analytics/"
+
+# Code dictionary for analytics.py, one code per line as `name: term, term*` (`*` matches
+# any word ending). Kept apart from CODES, which is part of the interviewer's system prompt.
+ANALYTICS_CODES = """"""
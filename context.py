@@ -0,0 +1,204 @@
+import math
+import asyncio
+import logging
+from collections import OrderedDict
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import Message, ConversationSummary
+
+logger = logging.getLogger(__name__)
+
+# Per-message overhead of the chat formats (role markers, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """You maintain a running summary of a qualitative research interview.
+You are given the current summary (possibly empty) and the next part of the transcript.
+Return an updated summary that keeps every fact the respondent shared, which questions of the
+interview outline were already asked and answered, and the language being used.
+Write in plain prose, no more than 300 words. Return only the summary."""
+
+
+class TokenCounter:
+    """
+    Counts tokens per message, remembering the result for recently seen messages
+    so history is only tokenized once. Uses tiktoken when it is installed and a
+    ~4 characters/token estimate otherwise.
+
+    Neither matches every provider and language (e.g. Anthropic's tokenizer, or
+    Cyrillic text without tiktoken), so counts are corrected per conversation by the
+    ratio of the prompt size the provider reported to the estimate (`calibrate`).
+    """
+
+    # Bounds and smoothing of the per-conversation correction
+    MIN_SCALE = 0.5
+    MAX_SCALE = 4.0
+    SCALE_WEIGHT = 0.5
+
+    def __init__(self, encoding_name: str = "o200k_base", max_entries: int = 50000, max_conversations: int = 10000):
+        self.max_entries = max_entries
+        self.max_conversations = max_conversations
+        self._counts = OrderedDict()
+        self._scales = OrderedDict() # conversation_id -> reported / estimated prompt tokens
+        try:
+            import tiktoken
+            self._encoding = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            self._encoding = None
+
+    def count_text(self, text: str) -> int:
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return (len(text) + 3) // 4
+
+    def count_message(self, message: dict, scale: float = 1.0) -> int:
+        """
+        Tokens of `message`, including the chat format's overhead, times `scale`.
+        """
+        content = message["content"]
+        count = self._counts.get(content)
+        if count is None:
+            count = self.count_text(content) + MESSAGE_OVERHEAD_TOKENS
+            self._counts[content] = count
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        else:
+            self._counts.move_to_end(content)
+        return math.ceil(count * scale)
+
+    def estimate_prompt(self, system_prompt: str, messages: list) -> int:
+        """
+        Uncorrected estimate of a request's prompt tokens.
+        """
+        return self.count_text(system_prompt) + sum(self.count_message(message) for message in messages)
+
+    def scale_for(self, conversation_id: int) -> float:
+        return self._scales.get(conversation_id, 1.0)
+
+    def calibrate(self, conversation_id: int, estimated: int, reported: int):
+        """
+        Move the conversation's correction towards `reported` / `estimated`, the prompt
+        tokens the provider reported for a request against `estimate_prompt`.
+        """
+        if estimated <= 0 or reported <= 0:
+            return
+        ratio = min(max(reported / estimated, self.MIN_SCALE), self.MAX_SCALE)
+        previous = self._scales.pop(conversation_id, None)
+        self._scales[conversation_id] = ratio if previous is None else previous + self.SCALE_WEIGHT * (ratio - previous)
+        if len(self._scales) > self.max_conversations:
+            self._scales.popitem(last=False)
+
+
+def build_context(history: list, token_budget: int, token_counter: TokenCounter, scale: float = 1.0):
+    """
+    Return (messages, dropped) where `messages` are the newest messages of `history`
+    that fit in `token_budget` tokens and `dropped` is how many older ones were left out.
+    The newest message is always included. Message counts are multiplied by `scale`
+    (see TokenCounter.calibrate).
+    """
+    total = 0
+    start = len(history)
+    while start > 0:
+        tokens = token_counter.count_message(history[start - 1], scale)
+        if total + tokens > token_budget and start < len(history):
+            break
+        total += tokens
+        start -= 1
+    return history[start:], start
+
+
+def summary_message(summary: str) -> dict:
+    return {
+        "role": "user",
+        "content": f"[Summary of the earlier part of this interview]\n{summary}"
+    }
+
+
+class ConversationSummarizer:
+    """
+    Maintains the rolling summary of turns that no longer fit in the context window.
+
+    Summaries are read through a small in-memory cache. Updates run as background
+    tasks (at most one per conversation) and fold the messages that fell out of the
+    window into the stored summary incrementally, so a turn never waits for them.
+    """
+
+    def __init__(self, provider, session_factory, max_cached: int = 1000, max_batch: int = 200):
+        self.provider = provider
+        self.session_factory = session_factory
+        self.max_cached = max_cached
+        self.max_batch = max_batch
+        self._summaries = OrderedDict() # conversation_id -> summary text or None
+        self._tasks = {}
+
+    async def get_summary(self, db: AsyncSession, conversation_id: int):
+        if conversation_id in self._summaries:
+            self._summaries.move_to_end(conversation_id)
+            return self._summaries[conversation_id]
+        row = await db.get(ConversationSummary, conversation_id)
+        summary = row.summary if row else None
+        self._remember(conversation_id, summary)
+        return summary
+
+    def _remember(self, conversation_id: int, summary):
+        self._summaries[conversation_id] = summary
+        self._summaries.move_to_end(conversation_id)
+        while len(self._summaries) > self.max_cached:
+            self._summaries.popitem(last=False)
+
+    def schedule_update(self, conversation_id: int, kept_in_context: int):
+        """
+        Summarize everything older than the `kept_in_context` newest messages.
+        """
+        if conversation_id in self._tasks:
+            return
+        task = asyncio.create_task(self._update(conversation_id, kept_in_context))
+        self._tasks[conversation_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(conversation_id, None))
+
+    async def _update(self, conversation_id: int, kept_in_context: int):
+        try:
+            async with self.session_factory() as db:
+                row = await db.get(ConversationSummary, conversation_id)
+                summarized_count = row.summarized_count if row else 0
+                total = await db.scalar(
+                    select(func.count(Message.id)).where(Message.conversation_id == conversation_id)
+                )
+                target = total - kept_in_context
+                if target <= summarized_count:
+                    return
+
+                result = await db.execute(
+                    select(Message.sender_role, Message.content)
+                    .where(Message.conversation_id == conversation_id)
+                    .order_by(Message.id)
+                    .offset(summarized_count)
+                    .limit(min(target - summarized_count, self.max_batch))
+                )
+                new_messages = result.all()
+                if not new_messages:
+                    return
+
+                transcript = "\n".join(f"{role}: {content}" for role, content in new_messages)
+                current = row.summary if row else ""
+                completion = await self.provider.complete(
+                    SUMMARY_PROMPT,
+                    [{"role": "user", "content": f"Current summary:\n{current}\n\nNext part of the transcript:\n{transcript}"}]
+                )
+
+                if row is None:
+                    row = ConversationSummary(conversation_id=conversation_id)
+                    db.add(row)
+                row.summary = completion.content
+                row.summarized_count = summarized_count + len(new_messages)
+                await db.commit()
+                self._remember(conversation_id, row.summary)
+                logger.info(f"Conversation {conversation_id} summary now covers {row.summarized_count} messages")
+        except Exception as e:
+            logger.error(f"Failed to update summary for conversation {conversation_id}: {e}", exc_info=True)
+
+    async def shutdown(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
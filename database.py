@@ -1,18 +1,111 @@
 import os
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, create_engine, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Index, create_engine, BigInteger, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime, timezone
 
 # Database URL: defaults to SQLite file 'bot.db' in project root, override via DATABASE_URL env var
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./bot.db")
 
-# Create engine and session factory
+# Connection pool settings for server databases such as Postgres
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))
+DB_POOL_TIMEOUT_SECONDS = int(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+# How long SQLite waits on a locked database before raising "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+# Sync drivers and the async driver used in their place
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgresql+psycopg": "postgresql+asyncpg",
+}
+
+
+def get_async_database_url(url: str) -> str:
+    """
+    Map a sync DATABASE_URL to its async driver: sqlite (pysqlite) -> aiosqlite,
+    postgresql (psycopg2/psycopg) -> asyncpg. Other URLs are returned unchanged.
+    """
+    scheme, sep, rest = url.partition("://")
+    if scheme in ASYNC_DRIVERS:
+        return f"{ASYNC_DRIVERS[scheme]}://{rest}"
+    return url
+
+
+# Async drivers and aliases, and the sync dialect used in their place
+SYNC_DRIVERS = {
+    "sqlite+aiosqlite": "sqlite",
+    "postgres": "postgresql",
+    "postgresql+asyncpg": "postgresql",
+}
+
+
+def get_sync_database_url(url: str) -> str:
+    """
+    Map DATABASE_URL to a URL the sync engine can use: the `postgres` alias becomes
+    `postgresql`, and async drivers are replaced by the dialect's default driver.
+    """
+    scheme, sep, rest = url.partition("://")
+    if scheme in SYNC_DRIVERS:
+        return f"{SYNC_DRIVERS[scheme]}://{rest}"
+    return url
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers proceed while a turn is being written; busy_timeout makes
+    # concurrent writers wait instead of failing immediately
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
+
+# Create engines and session factories.
+# The sync engine is used by maintenance scripts; the bot's handlers use the async one.
 if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+    engine = create_engine(get_sync_database_url(DATABASE_URL), connect_args={"check_same_thread": False})
+    async_engine = create_async_engine(get_async_database_url(DATABASE_URL))
+    if ":memory:" not in DATABASE_URL:
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+        event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
 else:
-    engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+    pool_options = dict(
+        pool_pre_ping=True,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS
+    )
+    engine = create_engine(get_sync_database_url(DATABASE_URL), **pool_options)
+    async_engine = create_async_engine(get_async_database_url(DATABASE_URL), **pool_options)
+
+
+
+def create_lock_engine(pool_size: int):
+    """
+    A separate async engine for the per-user advisory locks. A lock holds its connection
+    for the whole turn, so it must not compete with the handlers' own sessions for the
+    main pool. `pool_size` must cover the concurrent updates (main.py caps them to it).
+    """
+    return create_async_engine(
+        get_async_database_url(DATABASE_URL),
+        pool_pre_ping=True,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_recycle=DB_POOL_RECYCLE_SECONDS,
+        pool_timeout=DB_POOL_TIMEOUT_SECONDS
+    )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# expire_on_commit=False: ids of committed objects stay readable without a refresh query
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 
 # Base class for ORM models
 Base = declarative_base()
@@ -36,8 +129,14 @@ class Conversation(Base):
     started_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     ended_at = Column(DateTime, nullable=True)
 
+    # Serves the "open conversation for this user" lookup done on every turn
+    __table_args__ = (
+        Index("ix_conversations_user_id_ended_at", "user_id", "ended_at"),
+    )
+
     user = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation")
+    summary = relationship("ConversationSummary", back_populates="conversation", uselist=False)
 
 class Message(Base):
     __tablename__ = "messages"
@@ -47,12 +146,43 @@ class Message(Base):
     content = Column(String, nullable=False)
     timestamp = Column(DateTime, default=lambda: datetime.now(timezone.utc))
 
+    # History is filtered by conversation and ordered by the monotonic primary key,
+    # so one composite index serves both (and any conversation_id-only lookup)
+    __table_args__ = (
+        Index("ix_messages_conversation_id_id", "conversation_id", "id"),
+    )
+
     conversation = relationship("Conversation", back_populates="messages")
 
+class ConversationSummary(Base):
+    """
+    Rolling summary of the oldest part of a conversation, covering its first
+    `summarized_count` messages. Kept in its own table so existing databases
+    only need the new table created.
+    """
+    __tablename__ = "conversation_summaries"
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), primary_key=True)
+    summary = Column(String, nullable=False)
+    summarized_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    conversation = relationship("Conversation", back_populates="summary")
+
+class AuthorizedUser(Base):
+    """
+    Telegram users allowed to take part in the survey (used when ALLOWLIST_FROM_DB=true).
+    """
+    __tablename__ = "authorized_users"
+    telegram_user_id = Column(BigInteger, primary_key=True)
+    note = Column(String, nullable=True)
+    added_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
 
 def create_db_and_tables():
     """
     Create database tables based on ORM models.
+    For existing databases use the Alembic migrations instead (`alembic upgrade head`),
+    since create_all doesn't add indexes to tables that already exist.
     """
     Base.metadata.create_all(bind=engine)
 
@@ -0,0 +1,331 @@
+"""
+Export ended conversations for analysis.
+
+Writes, for every conversation ended since the previous run:
+  - TRANSCRIPTS_DIRECTORY/transcripts_<run>.jsonl   one line per conversation
+  - TIMES_DIRECTORY/times_<run>.csv                 one row per message with turn timings
+  - TIMES_DIRECTORY/times_<run>.parquet             same rows, columnar (needs pyarrow)
+
+Messages are streamed from the database with a server-side cursor, so memory use
+doesn't depend on the number of messages. The position reached is stored in
+TRANSCRIPTS_DIRECTORY/export_state.json; use --full to export everything again.
+
+Only conversations that ended more than --settle-minutes (EXPORT_SETTLE_MINUTES,
+default 5) ago are exported, and the stored position is that cutoff. ended_at is
+taken from the app clock before commit, possibly on several workers, so a
+conversation can become visible after one that ended later; the margin keeps the
+incremental export (and archive.py, which relies on it) from skipping it.
+
+Usage: python export.py [--full] [--batch-size N] [--settle-minutes M]
+"""
+import os
+import csv
+import json
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import select, and_, or_
+from sqlalchemy.orm import Session
+
+import config
+from database import Conversation, Message, User, SessionLocal
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = os.path.join(config.TRANSCRIPTS_DIRECTORY, "export_state.json")
+
+# How long after ending a conversation is assumed to be committed
+EXPORT_SETTLE_MINUTES = float(os.getenv("EXPORT_SETTLE_MINUTES", "5"))
+
+TIMES_COLUMNS = [
+    "conversation_id", "user_id", "message_id", "turn_index", "sender_role", "timestamp",
+    "response_latency_seconds", "think_time_seconds", "content_length", "content",
+]
+
+
+def load_state():
+    if not os.path.exists(STATE_FILE):
+        return None
+    with open(STATE_FILE) as f:
+        return json.load(f)
+
+
+def save_state(state: dict):
+    tmp_path = STATE_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_FILE)
+
+
+def stream_ended_messages(db: Session, after=None, batch_size: int = 5000, ended_before=None):
+    """
+    Yield (conversation id, user id, started_at, ended_at, telegram_user_id, message id,
+    sender_role, content, timestamp) for all messages of ended conversations, ordered by (ended_at, conversation id, message id).
+    `after` is an (ended_at, conversation_id) watermark; only later conversations are returned.
+    `ended_before` (naive UTC) leaves out conversations that ended at or after it.
+    """
+    query = (
+        select(
+            Conversation.id, Conversation.user_id, Conversation.started_at, Conversation.ended_at,
+            User.telegram_user_id,
+            Message.id, Message.sender_role, Message.content, Message.timestamp
+        )
+        .join(Message, Message.conversation_id == Conversation.id)
+        .join(User, User.id == Conversation.user_id)
+        .where(Conversation.ended_at != None)
+        .order_by(Conversation.ended_at, Conversation.id, Message.id)
+        .execution_options(yield_per=batch_size) # server-side cursor, fetched in batches
+    )
+    if after is not None:
+        ended_at, conversation_id = after
+        query = query.where(or_(
+            Conversation.ended_at > ended_at,
+            and_(Conversation.ended_at == ended_at, Conversation.id > conversation_id)
+        ))
+    if ended_before is not None:
+        query = query.where(Conversation.ended_at < ended_before)
+    yield from db.execute(query)
+
+
+def group_by_conversation(rows):
+    """
+    Group the ordered row stream into (conversation info, messages) one conversation at a time.
+    """
+    current_id = None
+    info = None
+    messages = []
+    for row in rows:
+        conversation_id, user_id, started_at, ended_at, telegram_user_id, message_id, role, content, timestamp = row
+        if conversation_id != current_id:
+            if current_id is not None:
+                yield info, messages
+            current_id = conversation_id
+            info = {
+                "conversation_id": conversation_id,
+                "user_id": user_id,
+                "telegram_user_id": telegram_user_id,
+                "started_at": started_at,
+                "ended_at": ended_at,
+            }
+            messages = []
+        messages.append((message_id, role, content, timestamp))
+    if current_id is not None:
+        yield info, messages
+
+
+def turn_timings(info: dict, messages: list):
+    """
+    Per-message timing rows. For an assistant message, response latency is the time
+    since the preceding user message; for a user message, think time is the time
+    since the preceding assistant message.
+    """
+    rows = []
+    last_user_at = None
+    last_assistant_at = None
+    turn_index = 0
+    for message_id, role, content, timestamp in messages:
+        response_latency = None
+        think_time = None
+        if role == "user":
+            turn_index += 1
+            if last_assistant_at and timestamp:
+                think_time = (timestamp - last_assistant_at).total_seconds()
+            last_user_at = timestamp
+        else:
+            if last_user_at and timestamp:
+                response_latency = (timestamp - last_user_at).total_seconds()
+            last_assistant_at = timestamp
+        rows.append({
+            "conversation_id": info["conversation_id"],
+            "user_id": info["user_id"],
+            "message_id": message_id,
+            "turn_index": turn_index,
+            "sender_role": role,
+            "timestamp": timestamp,
+            "response_latency_seconds": response_latency,
+            "think_time_seconds": think_time,
+            "content_length": len(content),
+            "content": content,
+        })
+    return rows
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+class ParquetTimesWriter:
+    """
+    Appends timing rows to a Parquet file in row groups of `batch_size`.
+    Does nothing (with a warning) if pyarrow is not installed.
+    """
+
+    def __init__(self, path: str, batch_size: int):
+        self.path = path
+        self.batch_size = batch_size
+        self._rows = []
+        self._writer = None
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            logger.warning("pyarrow is not installed, skipping the Parquet export.")
+            self.enabled = False
+            return
+        self.enabled = True
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._schema = pyarrow.schema([
+            ("conversation_id", pyarrow.int64()),
+            ("user_id", pyarrow.int64()),
+            ("message_id", pyarrow.int64()),
+            ("turn_index", pyarrow.int32()),
+            ("sender_role", pyarrow.string()),
+            ("timestamp", pyarrow.timestamp("us")),
+            ("response_latency_seconds", pyarrow.float64()),
+            ("think_time_seconds", pyarrow.float64()),
+            ("content_length", pyarrow.int32()),
+            ("content", pyarrow.string()),
+        ])
+
+    def write(self, rows: list):
+        if not self.enabled:
+            return
+        self._rows.extend(rows)
+        if len(self._rows) >= self.batch_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(self.path, self._schema, compression="zstd")
+        rows = [{**row, "timestamp": _naive_utc(row["timestamp"])} for row in self._rows]
+        self._writer.write_table(self._pa.Table.from_pylist(rows, schema=self._schema))
+        self._rows = []
+
+    def close(self):
+        if not self.enabled:
+            return
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+
+
+def _naive_utc(value):
+    # SQLite hands back naive datetimes; Postgres may return aware ones
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def export_conversation_transcript(conversation_id: int):
+    """
+    Write a single conversation to TRANSCRIPTS_DIRECTORY/conversation_<id>.json.
+    Used right after an interview ends; the incremental export picks it up later too.
+    """
+    os.makedirs(config.TRANSCRIPTS_DIRECTORY, exist_ok=True)
+    db: Session = SessionLocal()
+    try:
+        conversation = db.get(Conversation, conversation_id)
+        if conversation is None:
+            return None
+        messages = db.execute(
+            select(Message.id, Message.sender_role, Message.content, Message.timestamp)
+            .where(Message.conversation_id == conversation_id)
+            .order_by(Message.id)
+        ).all()
+        transcript = {
+            "conversation_id": conversation.id,
+            "user_id": conversation.user_id,
+            "started_at": _isoformat(conversation.started_at),
+            "ended_at": _isoformat(conversation.ended_at),
+            "messages": [
+                {"id": message_id, "role": role, "content": content, "timestamp": _isoformat(timestamp)}
+                for message_id, role, content, timestamp in messages
+            ],
+        }
+    finally:
+        db.close()
+
+    path = os.path.join(config.TRANSCRIPTS_DIRECTORY, f"conversation_{conversation_id}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(transcript, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def export(full: bool = False, batch_size: int = 5000, settle_minutes: float = EXPORT_SETTLE_MINUTES):
+    os.makedirs(config.TRANSCRIPTS_DIRECTORY, exist_ok=True)
+    os.makedirs(config.TIMES_DIRECTORY, exist_ok=True)
+
+    state = None if full else load_state()
+    after = None
+    if state:
+        after = (datetime.fromisoformat(state["ended_at"]), state["conversation_id"])
+    # Timestamps are stored as naive UTC
+    cutoff = _naive_utc(datetime.now(timezone.utc) - timedelta(minutes=settle_minutes))
+
+    run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    suffix = 1
+    while os.path.exists(os.path.join(config.TRANSCRIPTS_DIRECTORY, f"transcripts_{run}.jsonl")):
+        run = f"{run.split('_')[0]}_{suffix}"
+        suffix += 1
+    transcripts_path = os.path.join(config.TRANSCRIPTS_DIRECTORY, f"transcripts_{run}.jsonl")
+    times_path = os.path.join(config.TIMES_DIRECTORY, f"times_{run}.csv")
+    parquet = ParquetTimesWriter(os.path.join(config.TIMES_DIRECTORY, f"times_{run}.parquet"), batch_size)
+
+    conversations = 0
+    messages_written = 0
+    db: Session = SessionLocal()
+    try:
+        with open(transcripts_path, "w", encoding="utf-8") as transcripts_file, \
+                open(times_path, "w", newline="", encoding="utf-8") as times_file:
+            times_writer = csv.DictWriter(times_file, fieldnames=TIMES_COLUMNS)
+            times_writer.writeheader()
+
+            for info, messages in group_by_conversation(stream_ended_messages(db, after, batch_size, cutoff)):
+                transcript = {
+                    **info,
+                    "started_at": _isoformat(info["started_at"]),
+                    "ended_at": _isoformat(info["ended_at"]),
+                    "messages": [
+                        {"id": message_id, "role": role, "content": content, "timestamp": _isoformat(timestamp)}
+                        for message_id, role, content, timestamp in messages
+                    ],
+                }
+                transcripts_file.write(json.dumps(transcript, ensure_ascii=False) + "\n")
+
+                timings = turn_timings(info, messages)
+                times_writer.writerows({**row, "timestamp": _isoformat(row["timestamp"])} for row in timings)
+                parquet.write(timings)
+
+                conversations += 1
+                messages_written += len(messages)
+    finally:
+        parquet.close()
+        db.close()
+
+    # Everything that ended before the cutoff has been exported (conversation id 0 puts
+    # the watermark before any conversation ending exactly at the cutoff)
+    if after is None or cutoff > after[0]:
+        save_state({"ended_at": cutoff.isoformat(), "conversation_id": 0})
+
+    if conversations == 0:
+        # Nothing new: don't leave empty files behind
+        for path in (transcripts_path, times_path):
+            os.remove(path)
+        logger.info("No newly ended conversations to export.")
+        return
+
+    logger.info(f"Exported {conversations} conversations ({messages_written} messages) to {transcripts_path} and {times_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Export ended conversations and turn timings.")
+    parser.add_argument("--full", action="store_true", help="ignore the saved position and export everything")
+    parser.add_argument("--batch-size", type=int, default=5000, help="rows fetched per database round-trip")
+    parser.add_argument("--settle-minutes", type=float, default=EXPORT_SETTLE_MINUTES,
+                        help="only export conversations that ended at least this long ago")
+    args = parser.parse_args()
+    export(full=args.full, batch_size=args.batch_size, settle_minutes=args.settle_minutes)
@@ -0,0 +1,59 @@
+import time
+from collections import OrderedDict, deque
+
+
+class ConversationHistoryCache:
+    """
+    Write-through cache of recent conversation history, keyed by conversation id.
+
+    Each entry keeps at most `max_messages` {"role", "content"} dicts. Entries are
+    evicted least-recently-used once `max_conversations` is exceeded, and expire
+    `ttl_seconds` after they were last touched.
+    """
+
+    def __init__(self, max_conversations: int = 1000, ttl_seconds: float = 3600, max_messages: int = 100):
+        self.max_conversations = max_conversations
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._entries = OrderedDict() # conversation_id -> (last_access, deque of messages)
+
+    def get(self, conversation_id: int):
+        """
+        Return a copy of the cached history, or None on a miss or expired entry.
+        """
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return None
+        last_access, history = entry
+        now = time.monotonic()
+        if now - last_access > self.ttl_seconds:
+            del self._entries[conversation_id]
+            return None
+        self._entries[conversation_id] = (now, history)
+        self._entries.move_to_end(conversation_id)
+        return list(history)
+
+    def set(self, conversation_id: int, history: list):
+        self._entries[conversation_id] = (time.monotonic(), deque(history, maxlen=self.max_messages))
+        self._entries.move_to_end(conversation_id)
+        while len(self._entries) > self.max_conversations:
+            self._entries.popitem(last=False)
+
+    def append(self, conversation_id: int, role: str, content: str):
+        """
+        Append a newly saved message. Conversations that are not cached are left
+        alone; they'll be loaded from the database on the next read.
+        """
+        entry = self._entries.get(conversation_id)
+        if entry is None:
+            return
+        entry[1].append({"role": role, "content": content})
+
+    def invalidate(self, conversation_id: int):
+        self._entries.pop(conversation_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,22 +1,33 @@
 import os
+import asyncio
 import logging
+import multiprocessing
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session # Import Session
+from sqlalchemy import and_, select, update as sql_update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone # Import datetime and timezone
 import config
 
 # Import database models and functions
-from database import User, Conversation, Message, SessionLocal, create_db_and_tables
-
-# --- For OpenAI GPT ---
-from openai import OpenAI
-# --- For Anthropic Claude ---
-import anthropic
-# --- For Azure OpenAI ---
-from openai import AzureOpenAI
-from azure.core.credentials import AzureKeyCredential
+from database import User, Conversation, Message, AsyncSessionLocal, async_engine, create_db_and_tables, create_lock_engine, DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW
+
+# Async LLM providers (OpenAI / Anthropic / Azure OpenAI behind one interface),
+# routed with concurrency limits, retries and failover
+from router import create_router_from_env
+from concurrency import PerUserUpdateProcessor, PostgresChatLock
+from history_cache import ConversationHistoryCache
+from persistence import build_message_row, save_messages, MessageWriteBehindQueue
+from streaming import StreamingReply
+from send_queue import TelegramSendQueue, REPLY, NOTICE, split_message
+from context import TokenCounter, ConversationSummarizer, build_context, summary_message
+from postprocess import postprocess_reply, strip_end_codes
+from export import export_conversation_transcript
+from metrics import TurnTimer, start_metrics_server
+from authorization import Allowlist, UserLookupCache
+from coalescing import MessageCoalescer
 
 # Load environment variables from .env file
 load_dotenv()
@@ -29,52 +40,160 @@ logger = logging.getLogger(__name__)
 
 # Load API keys from environment variables
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 
-# Load Azure OpenAI environment variables
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT_URL")
-AZURE_OPENAI_API_VERSION = os.getenv("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_DEPLOYMENT_NAME = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+# Number of updates processed concurrently, and whether a single user's updates stay in order
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))
+PER_USER_ORDERING = os.getenv("PER_USER_ORDERING", "true") == "true"
+
+# Stream AI responses into the chat, editing the reply at most once per interval
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES") == "true"
+STREAM_EDIT_INTERVAL_SECONDS = float(os.getenv("STREAM_EDIT_INTERVAL_SECONDS", "1.5"))
+
+# Answer quick consecutive messages as one turn: wait until the respondent has been quiet
+# for the window, and drop a generation that no reply was shown for yet if another message arrives
+# (needs PER_USER_ORDERING)
+MESSAGE_COALESCING = os.getenv("MESSAGE_COALESCING") == "true"
+COALESCE_WINDOW_SECONDS = float(os.getenv("COALESCE_WINDOW_SECONDS", "1.0"))
+MAX_PENDING_MESSAGES = int(os.getenv("MAX_PENDING_MESSAGES", "10"))
+
+# Maximum number of most recent messages sent to the model as context
+HISTORY_LIMIT = 100
+# Token budget for the conversation history sent each turn (the system prompt is not counted)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "12000"))
+# Replace turns that no longer fit the budget with a rolling summary
+CONTEXT_SUMMARY = os.getenv("CONTEXT_SUMMARY") == "true"
+
+# Webhook mode: set WEBHOOK_URL to the public URL Telegram should call (instead of polling)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Required with several workers or nodes; a single process generates one if unset
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+# Whether this node points Telegram at WEBHOOK_URL; with several nodes, set it on one only
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "true") == "true"
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))
+# Several workers (here or on other nodes behind a load balancer) share a Postgres advisory
+# lock per user, and conversation state is then read only from the database
+MULTI_WORKER = os.getenv("MULTI_WORKER") == "true" or (WEBHOOK_URL is not None and WEBHOOK_WORKERS > 1)
+
+# Postgres connections per worker with several workers: up to DB_POOL_SIZE + DB_MAX_OVERFLOW
+# for the handlers' sessions plus CHAT_LOCK_POOL_SIZE for the per-user locks (and the odd one
+# for transcripts). Every worker on every node counts against the server's max_connections
+# (DB_MAX_CONNECTIONS). A running update holds a lock connection, so with several workers
+# at most CHAT_LOCK_POOL_SIZE updates per worker run at once.
+CHAT_LOCK_POOL_SIZE = int(os.getenv("CHAT_LOCK_POOL_SIZE", "16"))
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "100"))
+if MULTI_WORKER:
+    CONCURRENT_UPDATES = min(CONCURRENT_UPDATES, CHAT_LOCK_POOL_SIZE)
+
+# Outgoing messages are scheduled within Telegram's flood limits (~30 messages/s per bot,
+# ~1/s per chat). With several workers, each gets its share of the global rate.
+TELEGRAM_SEND_QUEUE = os.getenv("TELEGRAM_SEND_QUEUE", "true") == "true"
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+
+# Serve Prometheus metrics on this local port (webhook worker N uses METRICS_PORT + N)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0")) # 0 disables it
 
 # Check if tokens/keys are loaded
 if not TELEGRAM_BOT_TOKEN:
     logger.error("TELEGRAM_BOT_TOKEN is not set. Please check your .env file.")
     exit(1)
 
-ai_client = None
 # Use unified system prompt from config
 system_prompt_content = config.SYSTEM_PROMPT
 
-# Initialize AI client based on available API keys
-if OPENAI_API_KEY:
-    ai_client = OpenAI(api_key=OPENAI_API_KEY)
-    logger.info("Using OpenAI client.")
-elif ANTHROPIC_API_KEY:
-    ai_client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-    logger.info("Using Anthropic Claude client.")
-elif AZURE_OPENAI_API_KEY and AZURE_OPENAI_ENDPOINT and AZURE_OPENAI_API_VERSION and AZURE_OPENAI_DEPLOYMENT_NAME:
-    ai_client = AzureOpenAI(
-        azure_endpoint=AZURE_OPENAI_ENDPOINT,
-        api_key=AZURE_OPENAI_API_KEY,
-        api_version=AZURE_OPENAI_API_VERSION
-    )
-    logger.info("Using Azure OpenAI client.")
-else:
+# Initialize AI provider(s) based on available API keys
+ai_provider = create_router_from_env()
+if ai_provider is None:
     logger.error("No OpenAI, Anthropic, or Azure OpenAI API key found. Please set one in your .env file.")
     exit(1)
 
+# In-memory cache of recent history per conversation, kept in sync as messages are saved
+conversation_history_cache = ConversationHistoryCache(
+    max_conversations=0 if MULTI_WORKER else int(os.getenv("HISTORY_CACHE_SIZE", "1000")), # 0 disables it
+    ttl_seconds=float(os.getenv("HISTORY_CACHE_TTL_SECONDS", "3600")),
+    max_messages=HISTORY_LIMIT
+)
+
+# Token counts are cached per message so history is only tokenized once
+token_counter = TokenCounter()
+conversation_summarizer = None
+if CONTEXT_SUMMARY:
+    conversation_summarizer = ConversationSummarizer(ai_provider, AsyncSessionLocal, max_cached=0 if MULTI_WORKER else 1000)
+
+# Optional write-behind queue: turn messages are buffered and bulk-inserted in the background
+# (not with several workers: buffered rows would be invisible to the others)
+message_write_queue = None
+if os.getenv("MESSAGE_WRITE_BEHIND") == "true" and not MULTI_WORKER:
+    message_write_queue = MessageWriteBehindQueue(
+        AsyncSessionLocal,
+        flush_interval=float(os.getenv("MESSAGE_WRITE_BEHIND_INTERVAL_SECONDS", "0.5"))
+    )
+
+message_coalescer = None
+if MESSAGE_COALESCING and (PER_USER_ORDERING or MULTI_WORKER):
+    message_coalescer = MessageCoalescer(window=COALESCE_WINDOW_SECONDS, max_pending=MAX_PENDING_MESSAGES)
+
+telegram_send_queue = None
+if TELEGRAM_SEND_QUEUE:
+    telegram_send_queue = TelegramSendQueue(
+        global_rate=TELEGRAM_GLOBAL_RATE / (WEBHOOK_WORKERS if WEBHOOK_URL else 1),
+        chat_rate=TELEGRAM_CHAT_RATE,
+        chat_burst=TELEGRAM_CHAT_BURST
+    )
+
+# With several workers, per-user advisory locks are held on their own connections, one per
+# concurrent update, so they can never starve the handlers' sessions of connections
+chat_lock_engine = None
+if MULTI_WORKER and DATABASE_URL.startswith("postgres"):
+    chat_lock_engine = create_lock_engine(CHAT_LOCK_POOL_SIZE)
+
+# Background work (e.g. transcripts of finished interviews) that must not delay a reply
+background_tasks = set()
+
 # --- Authorized User IDs (for survey access control) ---
-# For now, you can populate this by manually adding your own Telegram user ID for testing.
-# In a real scenario, this list would be managed via an admin interface or pre-populated.
-AUTHORIZED_TELEGRAM_USER_IDS = {
-}
+# Loaded from ALLOWLIST_FILE (one Telegram user id per line) and/or the authorized_users
+# table (ALLOWLIST_FROM_DB=true), and reloaded periodically. If neither is configured everyone
+# is allowed; if one is, startup fails unless it can be read.
+authorized_users = Allowlist(
+    path=os.getenv("ALLOWLIST_FILE"),
+    session_factory=AsyncSessionLocal if os.getenv("ALLOWLIST_FROM_DB") == "true" else None,
+    reload_interval=float(os.getenv("ALLOWLIST_RELOAD_SECONDS", "30"))
+)
+
+# Telegram user id -> (user id, open conversation id) for returning users
+# (not with several workers: another worker may end the conversation)
+user_lookup_cache = UserLookupCache(
+    max_entries=0 if MULTI_WORKER else int(os.getenv("USER_CACHE_SIZE", "10000")), # 0 disables it
+    ttl_seconds=float(os.getenv("USER_CACHE_TTL_SECONDS", "3600"))
+)
 
 # Helper function to get or create a user and their current conversation
-def get_or_create_user_and_conversation(db: Session, telegram_user_id: int, first_name: str, last_name: str, username: str, is_bot: bool):
-    user = db.query(User).filter(User.telegram_user_id == telegram_user_id).first()
-    if not user:
+# Returns (user id, conversation id); returning users are served from the lookup cache
+async def get_or_create_user_and_conversation(db: AsyncSession, telegram_user_id: int, first_name: str, last_name: str, username: str, is_bot: bool):
+    cached = user_lookup_cache.get(telegram_user_id)
+    if cached is not None:
+        return cached
+
+    # Resolve the user and their open conversation (if any) in a single joined query
+    result = await db.execute(
+        select(User, Conversation).outerjoin(
+            Conversation,
+            and_(Conversation.user_id == User.id, Conversation.ended_at == None) # Find open conversations
+        ).where(User.telegram_user_id == telegram_user_id).limit(1)
+    )
+    user, conversation = result.first() or (None, None)
+
+    if user and conversation:
+        user_lookup_cache.set(telegram_user_id, user.id, conversation.id)
+        return user.id, conversation.id
+
+    # Anything missing is created together and committed once
+    is_new_user = user is None
+    if is_new_user:
         user = User(
             telegram_user_id=telegram_user_id,
             first_name=first_name,
@@ -83,53 +202,128 @@ def get_or_create_user_and_conversation(db: Session, telegram_user_id: int, firs
             is_bot=is_bot
         )
         db.add(user)
-        db.commit()
-        db.refresh(user)
+        await db.flush()
+    conversation = Conversation(user_id=user.id)
+    db.add(conversation)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # Another worker created the user first; use theirs
+        await db.rollback()
+        return await get_or_create_user_and_conversation(db, telegram_user_id, first_name, last_name, username, is_bot)
+
+    if is_new_user:
         logger.info(f"New user created: {user.username} (ID: {user.telegram_user_id})")
+    logger.info(f"New conversation started for user {user.telegram_user_id}")
+    user_lookup_cache.set(telegram_user_id, user.id, conversation.id)
+    return user.id, conversation.id
+
+# Helper function to get conversation history, from the cache or the DB on a miss
+async def get_conversation_history_from_db(db: AsyncSession, conversation_id: int):
+    history = conversation_history_cache.get(conversation_id)
+    if history is not None:
+        return history
+
+    # Only the last HISTORY_LIMIT messages are ever used, so don't load the rest
+    result = await db.execute(
+        select(Message.sender_role, Message.content).where(
+            Message.conversation_id == conversation_id
+        ).order_by(Message.id.desc()).limit(HISTORY_LIMIT)
+    )
+    messages = result.all()
 
-    # Get the active conversation for this user, or create a new one if none open
-    # A simple way for now: assume a new conversation starts with /start, or create one if no messages yet
-    conversation = db.query(Conversation).filter(
-        Conversation.user_id == user.id,
-        Conversation.ended_at == None # Find open conversations
-    ).first()
-
-    if not conversation:
-        conversation = Conversation(user_id=user.id)
-        db.add(conversation)
-        db.commit()
-        db.refresh(conversation)
-        logger.info(f"New conversation started for user {user.telegram_user_id}")
-    
-    return user, conversation
-
-# Helper function to get conversation history from DB
-def get_conversation_history_from_db(db: Session, conversation_id: int):
-    messages = db.query(Message).filter(
-        Message.conversation_id == conversation_id
-    ).order_by(Message.timestamp).all()
-    
     history = []
-    for msg in messages:
+    for msg in reversed(messages):
         history.append({"role": msg.sender_role, "content": msg.content})
+    # Messages still buffered by the write-behind queue aren't in the DB yet
+    if message_write_queue is not None:
+        for row in message_write_queue.pending_rows(conversation_id):
+            history.append({"role": row["sender_role"], "content": row["content"]})
+        history = history[-HISTORY_LIMIT:]
+    conversation_history_cache.set(conversation_id, history)
     return history
 
+# Helper function to persist the messages of one turn in a single transaction
+# If `end_conversation_id` is given, that conversation is closed in the same transaction
+async def save_turn_messages(db: AsyncSession, rows: list, end_conversation_id: int = None):
+    ended_conversations = {}
+    if end_conversation_id is not None:
+        ended_conversations[end_conversation_id] = datetime.now(timezone.utc)
+    if message_write_queue is not None:
+        message_write_queue.enqueue(rows, ended_conversations)
+        if ended_conversations:
+            # The close must be visible before the user's next message is looked up
+            await message_write_queue.flush()
+    else:
+        await save_messages(db, rows, ended_conversations)
+    for row in rows:
+        conversation_history_cache.append(row["conversation_id"], row["sender_role"], row["content"])
+    if end_conversation_id is not None:
+        conversation_history_cache.invalidate(end_conversation_id)
+
+
+async def write_transcript(conversation_id: int):
+    """Write the transcript of a finished interview without blocking the event loop."""
+    try:
+        path = await asyncio.to_thread(export_conversation_transcript, conversation_id)
+        logger.info(f"Transcript of conversation {conversation_id} written to {path}")
+    except Exception as e:
+        logger.error(f"Failed to write transcript for conversation {conversation_id}: {e}", exc_info=True)
+
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+async def send_text(message, text: str, priority: int = REPLY):
+    """Send `text` to the chat of `message`, through the send queue if it is enabled."""
+    if telegram_send_queue is not None:
+        return await telegram_send_queue.send_text(message, text, priority)
+    return [await message.reply_text(chunk) for chunk in split_message(text)]
+
+
+async def complete_unless_superseded(chat_id: int, reply: StreamingReply, generation_coroutine):
+    """
+    Run the generation, but abandon it and return None if the respondent sends
+    another message before any part of the reply has been shown.
+    """
+    if message_coalescer is None:
+        return await generation_coroutine
+    generation = asyncio.create_task(generation_coroutine)
+    newer_message = asyncio.create_task(message_coalescer.wait_for_message(chat_id))
+    try:
+        done, _ = await asyncio.wait({generation, newer_message}, return_when=asyncio.FIRST_COMPLETED)
+        if generation not in done and reply.sent_message is None:
+            generation.cancel()
+            await asyncio.gather(generation, return_exceptions=True)
+            return None
+        return await generation
+    finally:
+        newer_message.cancel()
+        if not generation.done():
+            generation.cancel()
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = update.message.from_user.id
     telegram_user = update.effective_user # Get full user object
 
-    if user_id not in AUTHORIZED_TELEGRAM_USER_IDS and len(AUTHORIZED_TELEGRAM_USER_IDS) > 0:
+    if not authorized_users.is_allowed(user_id):
         logger.warning(f"Unauthorized /start attempt by user ID: {user_id}")
-        await update.message.reply_text(
-            "Sorry, this bot is for authorized users only. Please contact your administrator for access."
+        await send_text(
+            update.message,
+            "Sorry, this bot is for authorized users only. Please contact your administrator for access.",
+            NOTICE
         )
         return
 
-    db: Session = SessionLocal()
+    db: AsyncSession = AsyncSessionLocal()
     try:
-        # Get or create user and their conversation
-        user, conversation = get_or_create_user_and_conversation(
+        # Get or create user and their conversation, bypassing the lookup cache
+        user_lookup_cache.invalidate(telegram_user.id)
+        db_user_id, conversation_id = await get_or_create_user_and_conversation(
             db, 
             telegram_user.id, 
             telegram_user.first_name, 
@@ -140,33 +334,31 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 
         # Mark any previous open conversations as ended if a new /start is issued
         # This is a simple logic for now; real survey might need more robust session management
-        db.query(Conversation).filter(
-            Conversation.user_id == user.id,
-            Conversation.id != conversation.id, # Exclude the current one
-            Conversation.ended_at == None
-        ).update({"ended_at": datetime.now(timezone.utc)})
-        db.commit()
-        
-        # Log the start message
-        new_message = Message(
-            conversation_id=conversation.id,
-            sender_role='user',
-            content='/start'
+        await db.execute(
+            sql_update(Conversation).where(
+                Conversation.user_id == db_user_id,
+                Conversation.id != conversation_id, # Exclude the current one
+                Conversation.ended_at == None
+            ).values(ended_at=datetime.now(timezone.utc))
         )
-        db.add(new_message)
-        db.commit()
 
-        await update.message.reply_text(
+        # Log the start message, committed together with the update above
+        db.add(Message(**build_message_row(conversation_id, 'user', '/start')))
+        await db.commit()
+        conversation_history_cache.append(conversation_id, 'user', '/start')
+
+        await send_text(
+            update.message,
             'Hello! I\'m your survey bot. Let\'s get started. '
             'You can type your responses, and I\'ll guide you through the survey.'
         )
-        logger.info(f"User {user_id} started the bot. Conversation ID: {conversation.id}")
+        logger.info(f"User {user_id} started the bot. Conversation ID: {conversation_id}")
 
     except Exception as e:
         logger.error(f"Error in start command for user {user_id}: {e}", exc_info=True)
-        await update.message.reply_text("Sorry, I encountered an error. Please try again later.")
+        await send_text(update.message, "Sorry, I encountered an error. Please try again later.", NOTICE)
     finally:
-        db.close()
+        await db.close()
 
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -174,114 +366,231 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     chat_id = update.message.chat_id # Chat ID is essentially user_id for private chats
     user_message_content = update.message.text
 
-    db: Session = SessionLocal()
+    db: AsyncSession = AsyncSessionLocal()
+    turn_rows = [] # Messages of this turn that still need to be persisted
+    timer = TurnTimer()
+    outcome = "error"
     try:
         # Access control
-        if user_id not in AUTHORIZED_TELEGRAM_USER_IDS and len(AUTHORIZED_TELEGRAM_USER_IDS) > 0:
+        if not authorized_users.is_allowed(user_id):
             logger.warning(f"Unauthorized message from user ID: {user_id} - '{user_message_content}'")
-            await update.message.reply_text(
-                "Sorry, I cannot process your request. This bot is for authorized users only."
+            await send_text(
+                update.message,
+                "Sorry, I cannot process your request. This bot is for authorized users only.",
+                NOTICE
             )
+            outcome = "rejected"
+            if message_coalescer is not None:
+                message_coalescer.discard(chat_id)
             return
 
         # Ensure private chat
         if update.message.chat.type != 'private':
-            await update.message.reply_text("Sorry, this bot only works in private chats.")
+            await send_text(update.message, "Sorry, this bot only works in private chats.", NOTICE)
             logger.warning(f"Message from non-private chat (type: {update.message.chat.type}) received from chat_id: {chat_id}")
+            outcome = "rejected"
+            if message_coalescer is not None:
+                message_coalescer.discard(chat_id)
             return
 
+        # Messages sent in quick succession are answered together, as one user message
+        if message_coalescer is not None:
+            with timer.stage("coalesce"):
+                pending_messages = await message_coalescer.collect(
+                    chat_id, update.message.message_id, user_message_content
+                )
+            if pending_messages is None:
+                outcome = "merged" # already answered as part of an earlier turn
+                return
+            user_message_content = "\n".join(pending_messages)
+            dropped = message_coalescer.take_dropped(chat_id)
+            if dropped:
+                logger.warning(f"{dropped} messages from chat {chat_id} were dropped (more than {MAX_PENDING_MESSAGES} waiting)")
+                await send_text(
+                    update.message,
+                    f"Sorry, I couldn't take in {dropped} of your last messages. "
+                    "Please send anything important again after my reply.",
+                    NOTICE
+                )
+
         # Get or create user and their active conversation
         # Note: If user sends message without /start, a new conversation will be created.
         # You might want to force /start or handle this differently for a formal survey.
-        user, conversation = get_or_create_user_and_conversation(
-            db, 
-            user_id, 
-            update.effective_user.first_name, 
-            update.effective_user.last_name, 
-            update.effective_user.username, 
-            update.effective_user.is_bot
-        )
+        with timer.stage("db_load"):
+            _, conversation_id = await get_or_create_user_and_conversation(
+                db, 
+                user_id, 
+                update.effective_user.first_name, 
+                update.effective_user.last_name, 
+                update.effective_user.username, 
+                update.effective_user.is_bot
+            )
+            # Get the recent history for context (served from the history cache; the DB is
+            # only queried on a miss)
+            conversation_history = await get_conversation_history_from_db(db, conversation_id)
         
-        # Save user's message to the database
-        user_message_db = Message(
-            conversation_id=conversation.id,
-            sender_role='user',
-            content=user_message_content
-        )
-        db.add(user_message_db)
-        db.commit()
-        db.refresh(user_message_db) # Refresh to get ID, timestamp etc.
-
-
-        # Get last 100 messages for context
-        # We fetch from DB now instead of in-memory dictionary
-        conversation_history = get_conversation_history_from_db(db, conversation.id)
-        messages_for_ai = conversation_history[-100:] # Use last 100 messages of the history
-
-        ai_response_content = "I'm thinking..." # Default response while AI processes
-
-        if OPENAI_API_KEY and ai_client:
-            # --- Interact with GPT ---
-            # Prepend system message for OpenAI
-            full_messages_for_ai = [{"role": "system", "content": system_prompt_content}] + messages_for_ai
-
-            response = ai_client.chat.completions.create(
-                model="gpt-4.1-2025-04-14",
-                messages=full_messages_for_ai,
-                temperature=0
+        # The user's message is saved together with the AI's response at the end of the turn
+        turn_rows.append(build_message_row(conversation_id, 'user', user_message_content))
+
+        # Keep the newest messages that fit the token budget
+        with timer.stage("history_build"):
+            conversation_history = (conversation_history + [{"role": "user", "content": user_message_content}])[-HISTORY_LIMIT:]
+            messages_for_ai, dropped_count = build_context(
+                conversation_history, CONTEXT_TOKEN_BUDGET, token_counter, token_counter.scale_for(conversation_id)
             )
-            ai_response_content = response.choices[0].message.content
-
-        elif ANTHROPIC_API_KEY and ai_client:
-            # --- Interact with Claude ---
-            response = ai_client.messages.create(
-                model="claude-sonnet-4-20250514",
-                max_tokens=1024,
-                messages=messages_for_ai, # For Claude, system prompt is a separate parameter
-                system=system_prompt_content,
-                temperature=0
+
+            # Older turns are represented by the rolling summary, which is brought up to date in the background
+            if conversation_summarizer is not None:
+                summary = await conversation_summarizer.get_summary(db, conversation_id)
+                if summary:
+                    messages_for_ai = [summary_message(summary)] + messages_for_ai
+                if dropped_count:
+                    conversation_summarizer.schedule_update(conversation_id, len(conversation_history) - dropped_count)
+
+        # Awaiting the async client lets other conversations progress while this one waits.
+        # A typing indicator is shown until the first token (or the full reply) arrives.
+        async with StreamingReply(
+            update.message, context.bot, edit_interval=STREAM_EDIT_INTERVAL_SECONDS, send_queue=telegram_send_queue
+        ) as reply:
+            async def on_delta(text: str):
+                timer.first_token()
+                # End codes are stripped from the partial text as it streams in
+                await reply.update(strip_end_codes(text))
+
+            with timer.stage("llm_total"):
+                completion = await complete_unless_superseded(chat_id, reply, ai_provider.complete(
+                    system_prompt_content,
+                    messages_for_ai,
+                    on_delta=on_delta if STREAM_RESPONSES else None
+                ))
+            if completion is None:
+                # The respondent kept typing: answer everything together in the next turn
+                message_coalescer.requeue(chat_id, pending_messages)
+                outcome = "superseded"
+                return
+            timer.record_usage(completion)
+            # Correct later token counts of this conversation by what the provider actually counted
+            token_counter.calibrate(
+                conversation_id, token_counter.estimate_prompt(system_prompt_content, messages_for_ai), completion.prompt_tokens
             )
-            ai_response_content = response.content[0].text
-        
-        elif AZURE_OPENAI_API_KEY and ai_client:
-            # --- Interact with Azure OpenAI ---
-            full_messages_for_ai = [{"role": "system", "content": system_prompt_content}] + messages_for_ai
-            response = ai_client.chat.completions.create(
-                model=AZURE_OPENAI_DEPLOYMENT_NAME,
-                messages=full_messages_for_ai,
-                temperature=0,
-                max_tokens=1024
+            ai_response_content = completion.content
+            logger.info(
+                f"Conversation {conversation_id} token usage: input={completion.input_tokens}, "
+                f"cached={completion.cached_input_tokens}, cache_write={completion.cache_write_tokens}, "
+                f"output={completion.output_tokens}"
             )
-            ai_response_content = response.choices[0].message.content
-        else:
-            logger.error("No AI client initialized. Please check your API keys.")
-            await update.message.reply_text("Sorry, I cannot process your request at the moment.")
-            return
 
-        # Save AI's response to the database
-        ai_message_db = Message(
-            conversation_id=conversation.id,
-            sender_role='assistant',
-            content=ai_response_content
-        )
-        db.add(ai_message_db)
-        db.commit()
-        db.refresh(ai_message_db)
+            # Replace an end-of-interview code with its closing message. The raw output is stored.
+            reply_text, conversation_ended = postprocess_reply(ai_response_content)
+
+            # Save both messages of the turn in one transaction, closing the conversation if it ended
+            turn_rows.append(build_message_row(conversation_id, 'assistant', ai_response_content))
+            with timer.stage("db_persist"):
+                await save_turn_messages(db, turn_rows, end_conversation_id=conversation_id if conversation_ended else None)
+            turn_rows = []
+            if conversation_ended:
+                # The next message starts a new conversation
+                user_lookup_cache.invalidate(user_id)
 
-        await update.message.reply_text(ai_response_content)
-        logger.info(f"Chat ID: {chat_id}, User: '{user_message_content}', AI: '{ai_response_content}'")
+            with timer.stage("telegram_send"):
+                await reply.finish(reply_text)
+
+        outcome = "ended" if conversation_ended else "ok"
+        if conversation_ended:
+            logger.info(f"Conversation {conversation_id} of user {user_id} ended.")
+            run_in_background(write_transcript(conversation_id))
+        logger.debug(f"Chat ID: {chat_id}, User: '{user_message_content}', AI: '{ai_response_content}'")
 
     except Exception as e:
         logger.error(f"Error processing message for user {user_id}: {e}", exc_info=True)
-        await update.message.reply_text("Sorry, I encountered an error. Please try again later.")
+        # Keep the user's answer even if no response could be generated
+        if turn_rows:
+            try:
+                await db.rollback()
+                await save_turn_messages(db, turn_rows[:1])
+            except Exception as save_error:
+                logger.error(f"Could not save message for user {user_id}: {save_error}", exc_info=True)
+        await send_text(update.message, "Sorry, I encountered an error. Please try again later.", NOTICE)
     finally:
-        db.close()
+        await db.close()
+        total = timer.finish(outcome)
+        if outcome not in ("rejected", "merged"):
+            logger.info(f"Turn for chat {chat_id} finished ({outcome}) in {total * 1000:.0f}ms: {timer.summary()}")
+
+async def post_init(application: Application) -> None:
+    """Start background workers once the application is running."""
+    await authorized_users.start()
+    if message_write_queue is not None:
+        await message_write_queue.start()
+
+
+async def post_shutdown(application: Application) -> None:
+    """Flush buffered messages and release the provider's HTTP connections."""
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await authorized_users.stop()
+    if conversation_summarizer is not None:
+        await conversation_summarizer.shutdown()
+    if message_write_queue is not None:
+        await message_write_queue.stop()
+    if telegram_send_queue is not None:
+        await telegram_send_queue.stop()
+    await ai_provider.close()
+    await async_engine.dispose()
+    if chat_lock_engine is not None:
+        await chat_lock_engine.dispose()
+
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Log the error and send a telegram message to notify the developer."""
     logger.error(f"Update {update} caused error {context.error}", exc_info=True)
     if update.effective_message:
-        await update.effective_message.reply_text("An internal error occurred. I've logged it.")
+        await send_text(update.effective_message, "An internal error occurred. I've logged it.", NOTICE)
+
+
+def build_application(request=None) -> Application:
+    """Create the application with its handlers. `request` replaces the HTTP layer (used by load tests)."""
+    # Process updates concurrently; optionally keep each user's messages in sequence
+    if MULTI_WORKER:
+        concurrent_updates = PerUserUpdateProcessor(
+            CONCURRENT_UPDATES, shared_lock=PostgresChatLock(chat_lock_engine), coalescer=message_coalescer
+        )
+    elif PER_USER_ORDERING:
+        concurrent_updates = PerUserUpdateProcessor(CONCURRENT_UPDATES, coalescer=message_coalescer)
+    else:
+        concurrent_updates = CONCURRENT_UPDATES
+
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(concurrent_updates)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
+
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    application.add_error_handler(error_handler)
+    return application
+
+
+def run_webhook_worker(reuse_port: bool, secret_token: str, worker_index: int = 0) -> None:
+    """Entry point of a single webhook worker process."""
+    # aiohttp is only needed in webhook mode, so it isn't imported at module load
+    from webhook import serve_webhook
+    # Every worker has its own metrics, so each serves them on its own port
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + worker_index)
+    asyncio.run(serve_webhook(
+        build_application(),
+        WEBHOOK_LISTEN,
+        WEBHOOK_PORT,
+        WEBHOOK_PATH,
+        secret_token=secret_token,
+        reuse_port=reuse_port
+    ))
 
 
 def main() -> None:
@@ -290,15 +599,58 @@ def main() -> None:
     if os.getenv("CREATE_DB_ON_START") == "true":
         create_db_and_tables()
 
+    if MULTI_WORKER and not DATABASE_URL.startswith("postgres"):
+        logger.error("Running several workers requires a Postgres DATABASE_URL.")
+        exit(1)
+    if MULTI_WORKER:
+        per_worker = DB_POOL_SIZE + DB_MAX_OVERFLOW + CHAT_LOCK_POOL_SIZE
+        logger.info(
+            f"Each worker may open up to {per_worker} database connections, "
+            f"{per_worker * WEBHOOK_WORKERS} for the {WEBHOOK_WORKERS} workers of this node"
+        )
+        if per_worker * WEBHOOK_WORKERS > DB_MAX_CONNECTIONS:
+            logger.warning(
+                f"That exceeds DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS}; lower DB_POOL_SIZE, DB_MAX_OVERFLOW, "
+                f"CHAT_LOCK_POOL_SIZE or WEBHOOK_WORKERS (and count the workers on other nodes too)"
+            )
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    if not WEBHOOK_URL:
+        application = build_application()
+        if METRICS_PORT:
+            start_metrics_server(METRICS_PORT)
+        logger.info("Bot started polling...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        return
 
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    application.add_error_handler(error_handler)
+    # Telegram sends the secret with every update, so forged requests can be rejected.
+    # Every node must accept the same one: a secret generated here would be replaced by
+    # the next node to register, and this node would then reject its share of updates.
+    if MULTI_WORKER and not WEBHOOK_SECRET_TOKEN:
+        logger.error("Running several workers requires WEBHOOK_SECRET_TOKEN, shared by all nodes.")
+        exit(1)
+    from webhook import register_webhook, generate_secret_token
+    secret_token = WEBHOOK_SECRET_TOKEN or generate_secret_token()
+    # The webhook is registered once here, not by every worker
+    if WEBHOOK_REGISTER:
+        asyncio.run(register_webhook(TELEGRAM_BOT_TOKEN, WEBHOOK_URL, secret_token=secret_token))
+    if WEBHOOK_WORKERS == 1:
+        run_webhook_worker(reuse_port=False, secret_token=secret_token)
+        return
 
-    logger.info("Bot started polling...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Workers share the port (SO_REUSEPORT); the kernel spreads connections between them
+    ctx = multiprocessing.get_context("spawn")
+    workers = [ctx.Process(target=run_webhook_worker, args=(True, secret_token, index)) for index in range(WEBHOOK_WORKERS)]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {WEBHOOK_WORKERS} webhook workers on port {WEBHOOK_PORT}")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
 
 if __name__ == '__main__':
     main()
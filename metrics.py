@@ -0,0 +1,124 @@
+import os
+import time
+import logging
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Prometheus and OpenTelemetry are optional: without them turns are still timed and logged
+try:
+    from prometheus_client import Counter, Histogram, Gauge, start_http_server
+except ImportError:
+    Counter = Histogram = Gauge = start_http_server = None
+
+tracer = None
+if os.getenv("OTEL_TRACING") == "true":
+    try:
+        from opentelemetry import trace
+        tracer = trace.get_tracer("survey-bot")
+    except ImportError:
+        logger.warning("OTEL_TRACING is set but opentelemetry-api is not installed.")
+
+# Buckets sized for LLM turns: tens of milliseconds up to a minute
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60)
+
+if Histogram is not None:
+    TURN_SECONDS = Histogram(
+        "bot_turn_seconds", "Time to handle one respondent message end to end", ["outcome"],
+        buckets=LATENCY_BUCKETS
+    )
+    STAGE_SECONDS = Histogram(
+        "bot_turn_stage_seconds", "Time spent in each stage of a turn", ["stage"],
+        buckets=LATENCY_BUCKETS
+    )
+    LLM_TOKENS = Counter(
+        "bot_llm_tokens_total", "Tokens reported by the provider", ["provider", "kind"]
+    )
+    IN_FLIGHT_TURNS = Gauge("bot_turns_in_flight", "Turns currently being handled")
+
+
+def start_metrics_server(port: int):
+    """
+    Serve /metrics on `port`. Returns False if prometheus_client is not installed.
+    """
+    if start_http_server is None:
+        logger.warning("METRICS_PORT is set but prometheus_client is not installed; metrics are disabled.")
+        return False
+    start_http_server(port)
+    logger.info(f"Prometheus metrics available on port {port}")
+    return True
+
+
+class TurnTimer:
+    """
+    Times the stages of one turn. Each stage is recorded in the stage histogram and,
+    when tracing is on, as a child span of the turn span.
+
+    Usage:
+        timer = TurnTimer()
+        with timer.stage("db_load"):
+            ...
+        timer.finish("ok")
+
+    Stage names used by the bot: db_load, history_build, llm_total, llm_first_token,
+    db_persist, telegram_send.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._open_stages = {}
+        self._first_token_seen = False
+        self._span = tracer.start_span("turn") if tracer else None
+        if Histogram is not None:
+            IN_FLIGHT_TURNS.inc()
+
+    @contextmanager
+    def stage(self, name: str):
+        started = time.perf_counter()
+        self._open_stages[name] = started
+        # The turn span is never made current, so it is passed as the parent explicitly
+        span = tracer.start_as_current_span(name, context=trace.set_span_in_context(self._span)) if tracer else nullcontext()
+        try:
+            with span:
+                yield
+        finally:
+            del self._open_stages[name]
+            self.record(name, time.perf_counter() - started)
+
+    def record(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+        if Histogram is not None:
+            STAGE_SECONDS.labels(name).observe(seconds)
+
+    def first_token(self, stage: str = "llm_total"):
+        """
+        Record time to first token, measured from the start of the open `stage`.
+        Called for every streamed delta; only the first call counts.
+        """
+        if self._first_token_seen or stage not in self._open_stages:
+            return
+        self._first_token_seen = True
+        self.record("llm_first_token", time.perf_counter() - self._open_stages[stage])
+
+    def record_usage(self, completion):
+        if Histogram is None:
+            return
+        provider = completion.provider or "unknown"
+        LLM_TOKENS.labels(provider, "input").inc(completion.input_tokens)
+        LLM_TOKENS.labels(provider, "output").inc(completion.output_tokens)
+        LLM_TOKENS.labels(provider, "cached_input").inc(completion.cached_input_tokens)
+        LLM_TOKENS.labels(provider, "cache_write").inc(completion.cache_write_tokens)
+
+    def finish(self, outcome: str) -> float:
+        total = time.perf_counter() - self.started
+        if Histogram is not None:
+            TURN_SECONDS.labels(outcome).observe(total)
+            IN_FLIGHT_TURNS.dec()
+        if self._span is not None:
+            self._span.set_attribute("outcome", outcome)
+            self._span.end()
+        return total
+
+    def summary(self) -> str:
+        return ", ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.stages.items())
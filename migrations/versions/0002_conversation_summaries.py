@@ -0,0 +1,31 @@
+"""conversation summaries
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases set up with create_db_and_tables() may already have the table
+    if sa.inspect(op.get_bind()).has_table("conversation_summaries"):
+        return
+    op.create_table(
+        "conversation_summaries",
+        sa.Column("conversation_id", sa.Integer(), sa.ForeignKey("conversations.id"), primary_key=True),
+        sa.Column("summary", sa.String(), nullable=False),
+        sa.Column("summarized_count", sa.Integer(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("conversation_summaries")
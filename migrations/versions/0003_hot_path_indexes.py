@@ -0,0 +1,41 @@
+"""indexes for the per-turn message and conversation lookups
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_messages_conversation_id_id", "messages", ["conversation_id", "id"]),
+    ("ix_conversations_user_id_ended_at", "conversations", ["user_id", "ended_at"]),
+]
+
+
+def _existing_indexes(table):
+    return {index["name"] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == "postgresql"
+    for name, table, columns in INDEXES:
+        if name in _existing_indexes(table):
+            continue
+        if is_postgres:
+            # CONCURRENTLY can't run inside a transaction, but keeps the table writable
+            with op.get_context().autocommit_block():
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+        else:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    for name, table, _ in INDEXES:
+        op.drop_index(name, table_name=table)
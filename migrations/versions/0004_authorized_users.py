@@ -0,0 +1,30 @@
+"""authorized users
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17 00:00:00
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases set up with create_db_and_tables() may already have the table
+    if sa.inspect(op.get_bind()).has_table("authorized_users"):
+        return
+    op.create_table(
+        "authorized_users",
+        sa.Column("telegram_user_id", sa.BigInteger(), primary_key=True),
+        sa.Column("note", sa.String(), nullable=True),
+        sa.Column("added_at", sa.DateTime(), nullable=True),
+    )
+
+
+def downgrade():
+    op.drop_table("authorized_users")
@@ -0,0 +1,198 @@
+import os
+import json
+import asyncio
+import logging
+from datetime import datetime, timezone
+from sqlalchemy import insert, update
+from sqlalchemy.exc import InterfaceError, OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import config
+from database import Message, Conversation
+
+logger = logging.getLogger(__name__)
+
+
+def build_message_row(conversation_id: int, sender_role: str, content: str) -> dict:
+    """
+    Build a row for the messages table. The timestamp is taken now, so it reflects
+    when the message was sent/received rather than when it was written.
+    """
+    return {
+        "conversation_id": conversation_id,
+        "sender_role": sender_role,
+        "content": content,
+        "timestamp": datetime.now(timezone.utc),
+    }
+
+
+async def save_messages(db: AsyncSession, rows: list, ended_conversations: dict = None):
+    """
+    Insert all rows in a single bulk INSERT and commit once. `ended_conversations`
+    maps conversation ids to the time they ended; they are closed in the same transaction.
+    """
+    if not rows and not ended_conversations:
+        return
+    if rows:
+        await db.execute(insert(Message), rows)
+    for conversation_id, ended_at in (ended_conversations or {}).items():
+        await db.execute(
+            update(Conversation).where(Conversation.id == conversation_id).values(ended_at=ended_at)
+        )
+    await db.commit()
+
+
+def _is_transient(error: Exception) -> bool:
+    # Connection problems and locks pass; constraint or data errors fail again on every retry
+    return isinstance(error, (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)) \
+        or getattr(error, "connection_invalidated", False)
+
+
+class MessageWriteBehindQueue:
+    """
+    Buffers message rows and writes them in bulk from a background task, so a turn
+    doesn't wait on a commit. Rows are flushed every `flush_interval` seconds or as
+    soon as `max_batch` rows are pending, and anything left is flushed on `stop`.
+
+    A batch that fails is retried on the next flush, indefinitely while the database
+    is unreachable. Any other error is retried `max_attempts` times; then the rows are
+    written one at a time and those that still fail are appended to `rejected_path`
+    (JSON Lines, default BACKUPS_DIRECTORY/rejected_messages.jsonl) so they can be
+    recovered, and one bad row can't hold back every later message.
+    """
+
+    def __init__(self, session_factory, flush_interval: float = 0.5, max_batch: int = 500, max_attempts: int = 3,
+                 rejected_path: str = None):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.rejected_path = rejected_path or os.path.join(config.BACKUPS_DIRECTORY, "rejected_messages.jsonl")
+        self.rejected_rows = 0
+        self._failed_attempts = 0
+        self._pending = []
+        self._pending_ends = {}
+        self._in_flight = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock() # keeps batches committed in order
+        self._task = None
+
+    def enqueue(self, rows: list, ended_conversations: dict = None):
+        self._pending.extend(rows)
+        self._pending_ends.update(ended_conversations or {})
+        if len(self._pending) >= self.max_batch:
+            self._wakeup.set()
+
+    def pending_rows(self, conversation_id: int) -> list:
+        """
+        Rows of a conversation that are not in the database yet, oldest first.
+        """
+        return [row for row in self._in_flight + self._pending if row["conversation_id"] == conversation_id]
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            await self._flush()
+
+    async def _flush(self):
+        while self._pending or self._pending_ends:
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            # Conversations are closed together with the last batch, after their final messages
+            ends = {}
+            if not self._pending:
+                ends, self._pending_ends = self._pending_ends, {}
+            self._in_flight = batch
+            try:
+                await self._write_batch(batch, ends)
+            except asyncio.CancelledError:
+                # Stopped mid-write; `stop` flushes the batch again
+                self._pending[:0] = batch
+                self._pending_ends.update(ends)
+                raise
+            except Exception as e:
+                if not _is_transient(e):
+                    self._failed_attempts += 1
+                if self._failed_attempts < self.max_attempts:
+                    # Put the batch back so it's retried on the next flush
+                    self._pending[:0] = batch
+                    self._pending_ends.update(ends)
+                    logger.error(f"Failed to write {len(batch)} buffered messages: {e}", exc_info=True)
+                    return
+                self._failed_attempts = 0
+                logger.error(
+                    f"Writing {len(batch)} buffered messages failed {self.max_attempts} times, writing them one by one: {e}"
+                )
+                if not await self._write_one_by_one(batch, ends):
+                    return
+            else:
+                self._failed_attempts = 0
+            finally:
+                self._in_flight = []
+
+    async def _write_one_by_one(self, batch: list, ends: dict) -> bool:
+        """
+        Write rows in separate transactions, setting aside those that fail. Returns False
+        (with the unwritten rows queued again) if the database became unreachable.
+        """
+        for index, row in enumerate(batch):
+            try:
+                await self._write_batch([row], {})
+            except Exception as e:
+                if _is_transient(e):
+                    self._pending[:0] = batch[index:]
+                    self._pending_ends.update(ends)
+                    return False
+                self._set_aside(row, e)
+        if ends:
+            try:
+                await self._write_batch([], ends)
+            except Exception as e:
+                if _is_transient(e):
+                    self._pending_ends.update(ends)
+                    return False
+                logger.error(f"Could not close conversations {sorted(ends)}: {e}")
+        return True
+
+    def _set_aside(self, row: dict, error: Exception):
+        self.rejected_rows += 1
+        record = {**row, "timestamp": row["timestamp"].isoformat() if row.get("timestamp") else None, "error": str(error)}
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        try:
+            os.makedirs(os.path.dirname(self.rejected_path) or ".", exist_ok=True)
+            with open(self.rejected_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as file_error:
+            # Last resort: the row itself goes to the log
+            logger.error(f"Could not write {self.rejected_path} ({file_error}); rejected message: {line}")
+            return
+        logger.error(
+            f"A {row['sender_role']} message of conversation {row['conversation_id']} can't be written ({error}); "
+            f"saved to {self.rejected_path}"
+        )
+
+    async def _write_batch(self, batch: list, ended_conversations: dict):
+        async with self.session_factory() as db:
+            await save_messages(db, batch, ended_conversations)
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
@@ -0,0 +1,33 @@
+import config
+
+
+def find_end_code(text: str):
+    """
+    Return the first end-of-interview code from config.CLOSING_MESSAGES found in `text`, or None.
+    """
+    for code in config.CLOSING_MESSAGES:
+        if code in text:
+            return code
+    return None
+
+
+def strip_end_codes(text: str) -> str:
+    for code in config.CLOSING_MESSAGES:
+        text = text.replace(code, "")
+    return text.strip()
+
+
+def postprocess_reply(text: str):
+    """
+    Turn the model output into the text sent to the respondent.
+    Returns (reply_text, ended): end codes are never shown; when one is present the
+    matching closing message is appended and `ended` is True.
+    """
+    code = find_end_code(text)
+    if code is None:
+        return text, False
+    remaining = strip_end_codes(text)
+    closing_message = config.CLOSING_MESSAGES[code]
+    if remaining:
+        return f"{remaining}\n\n{closing_message}", True
+    return closing_message, True
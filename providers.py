@@ -0,0 +1,278 @@
+import os
+import asyncio
+import logging
+from dataclasses import dataclass
+
+# The provider SDKs (openai, anthropic) are imported by the provider factories below,
+# so only the SDKs of configured providers are loaded; each takes a noticeable part of startup time
+
+logger = logging.getLogger(__name__)
+
+# Mark the static system prompt / conversation prefix as cacheable where the API needs it
+PROMPT_CACHING = os.getenv("PROMPT_CACHING", "true") == "true"
+
+
+@dataclass
+class Completion:
+    """
+    A model reply plus the token usage reported by the provider.
+    `cached_input_tokens` counts prompt tokens served from the provider's prompt cache.
+    `prompt_tokens` is the whole prompt, however it was billed (Anthropic's
+    `input_tokens` leave out cache reads and writes, OpenAI's include them).
+    """
+    content: str
+    prompt_tokens: int = 0
+    input_tokens: int = 0
+    output_tokens: int = 0
+    cached_input_tokens: int = 0
+    cache_write_tokens: int = 0
+    provider: str = ""
+
+
+class LLMProvider:
+    """
+    Common async interface over the supported chat completion APIs.
+    Handlers only ever call `complete`, so they never block the event loop
+    and don't need to know which provider is configured.
+    """
+    name = "base"
+
+    def __init__(self, client, model: str, max_tokens: int = None, temperature: float = 0):
+        self.client = client
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+
+    async def complete(self, system_prompt: str, messages: list, on_delta=None) -> Completion:
+        """
+        Return the assistant reply for `messages` (list of {"role", "content"} dicts).
+        If `on_delta` is given the response is streamed, and `await on_delta(text_so_far)`
+        is called as tokens arrive.
+        """
+        raise NotImplementedError
+
+    def is_retryable(self, error: Exception) -> bool:
+        """
+        Whether a failed request is worth retrying: timeouts, connection errors,
+        rate limits and server-side errors. Both SDKs expose `status_code` on API errors.
+        """
+        if isinstance(error, (asyncio.TimeoutError, self._connection_error_type())):
+            return True
+        status_code = getattr(error, "status_code", None)
+        return status_code in (408, 409, 429) or (status_code is not None and status_code >= 500)
+
+    @staticmethod
+    def _connection_error_type():
+        """The SDK's exception type for network failures."""
+        return ()
+
+    async def close(self):
+        await self.client.close()
+
+
+class OpenAIProvider(LLMProvider):
+    name = "openai"
+
+    @staticmethod
+    def _connection_error_type():
+        import openai
+        return openai.APIConnectionError
+
+    async def complete(self, system_prompt: str, messages: list, on_delta=None) -> Completion:
+        # Prepend system message for OpenAI. Prompt caching is automatic for identical
+        # prefixes, so the static system prompt always comes first and history is
+        # only ever appended to.
+        full_messages = [{"role": "system", "content": system_prompt}] + messages
+        kwargs = {}
+        if self.max_tokens:
+            kwargs["max_tokens"] = self.max_tokens
+        if on_delta is not None:
+            return await self._stream(full_messages, on_delta, **kwargs)
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=full_messages,
+            temperature=self.temperature,
+            **kwargs
+        )
+        return self._completion(response.choices[0].message.content, response.usage, self.name)
+
+    async def _stream(self, full_messages: list, on_delta, **kwargs) -> Completion:
+        stream = await self.client.chat.completions.create(
+            model=self.model,
+            messages=full_messages,
+            temperature=self.temperature,
+            stream=True,
+            stream_options={"include_usage": True}, # usage arrives in the final chunk
+            **kwargs
+        )
+        text = ""
+        usage = None
+        async for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                text += chunk.choices[0].delta.content
+                await on_delta(text)
+        return self._completion(text, usage, self.name)
+
+    @staticmethod
+    def _completion(content: str, usage, provider: str) -> Completion:
+        cached_tokens = 0
+        if usage and usage.prompt_tokens_details:
+            cached_tokens = usage.prompt_tokens_details.cached_tokens or 0
+        return Completion(
+            content=content,
+            prompt_tokens=usage.prompt_tokens if usage else 0,
+            input_tokens=usage.prompt_tokens if usage else 0,
+            output_tokens=usage.completion_tokens if usage else 0,
+            cached_input_tokens=cached_tokens,
+            provider=provider
+        )
+
+
+class AzureOpenAIProvider(OpenAIProvider):
+    # Same wire format as OpenAI, `model` is the deployment name
+    name = "azure"
+
+
+class AnthropicProvider(LLMProvider):
+    name = "anthropic"
+
+    @staticmethod
+    def _connection_error_type():
+        import anthropic
+        return anthropic.APIConnectionError
+
+    async def complete(self, system_prompt: str, messages: list, on_delta=None) -> Completion:
+        system = system_prompt
+        if PROMPT_CACHING:
+            system, messages = self._with_cache_breakpoints(system_prompt, messages)
+        request = dict(
+            model=self.model,
+            max_tokens=self.max_tokens or 1024,
+            messages=messages, # For Claude, system prompt is a separate parameter
+            system=system,
+            temperature=self.temperature
+        )
+        if on_delta is None:
+            response = await self.client.messages.create(**request)
+            return self._completion(response.content[0].text, response.usage, self.name)
+
+        text = ""
+        async with self.client.messages.stream(**request) as stream:
+            async for delta in stream.text_stream:
+                text += delta
+                await on_delta(text)
+            response = await stream.get_final_message()
+        return self._completion(text, response.usage, self.name)
+
+    @staticmethod
+    def _completion(content: str, usage, provider: str) -> Completion:
+        return Completion(
+            content=content,
+            prompt_tokens=usage.input_tokens + (usage.cache_read_input_tokens or 0) + (usage.cache_creation_input_tokens or 0),
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            cached_input_tokens=usage.cache_read_input_tokens or 0,
+            cache_write_tokens=usage.cache_creation_input_tokens or 0,
+            provider=provider
+        )
+
+    @staticmethod
+    def _with_cache_breakpoints(system_prompt: str, messages: list):
+        """
+        Add cache-control breakpoints after the system prompt and after the latest
+        message. The next turn re-sends the same prefix plus two new messages, so
+        everything up to this turn's breakpoint is read from the cache.
+        """
+        system = [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+        if not messages:
+            return system, messages
+        last = messages[-1]
+        messages = messages[:-1] + [{
+            "role": last["role"],
+            "content": [{"type": "text", "text": last["content"], "cache_control": {"type": "ephemeral"}}]
+        }]
+        return system, messages
+
+
+# Provider name (as used in LLM_PROVIDERS) -> factory returning a provider, or None if
+# the provider isn't configured. Factories import their SDK only when called.
+PROVIDER_FACTORIES = {}
+
+
+def register_provider(name: str):
+    """Register a provider factory under `name`."""
+    def decorator(factory):
+        PROVIDER_FACTORIES[name] = factory
+        return factory
+    return decorator
+
+
+@register_provider("openai")
+def create_openai_provider():
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    from openai import AsyncOpenAI
+    logger.info("Using OpenAI client.")
+    return OpenAIProvider(
+        AsyncOpenAI(api_key=api_key, max_retries=0),
+        model="gpt-4.1-2025-04-14"
+    )
+
+
+@register_provider("anthropic")
+def create_anthropic_provider():
+    api_key = os.getenv("ANTHROPIC_API_KEY")
+    if not api_key:
+        return None
+    from anthropic import AsyncAnthropic
+    logger.info("Using Anthropic Claude client.")
+    return AnthropicProvider(
+        AsyncAnthropic(api_key=api_key, max_retries=0),
+        model="claude-sonnet-4-20250514",
+        max_tokens=1024
+    )
+
+
+@register_provider("azure")
+def create_azure_provider():
+    api_key = os.getenv("AZURE_OPENAI_API_KEY")
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT_URL")
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+    deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME")
+    if not (api_key and endpoint and api_version and deployment):
+        return None
+    from openai import AsyncAzureOpenAI
+    logger.info("Using Azure OpenAI client.")
+    return AzureOpenAIProvider(
+        AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            max_retries=0
+        ),
+        model=deployment,
+        max_tokens=1024
+    )
+
+
+def create_providers_from_env():
+    """
+    Build a provider for every configured entry of LLM_PROVIDERS (default
+    "openai,anthropic,azure"), in that order. The first one is the primary.
+    SDK-level retries are disabled; the router handles retries and timeouts.
+    """
+    order = [name.strip() for name in os.getenv("LLM_PROVIDERS", "openai,anthropic,azure").split(",") if name.strip()]
+
+    providers = []
+    for name in order:
+        factory = PROVIDER_FACTORIES.get(name)
+        if factory is None:
+            logger.warning(f"Unknown LLM provider '{name}' in LLM_PROVIDERS, skipping it.")
+            continue
+        provider = factory()
+        if provider is not None:
+            providers.append(provider)
+    return providers
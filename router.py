@@ -0,0 +1,197 @@
+import os
+import asyncio
+import logging
+import random
+import time
+
+from providers import LLMProvider, Completion, create_providers_from_env
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderState:
+    """
+    Per-provider limits and health: a concurrency semaphore, a request-rate token
+    bucket, and a circuit breaker that takes the provider out of rotation for
+    `cooldown_seconds` after `failure_threshold` consecutive failures.
+    """
+
+    def __init__(self, provider: LLMProvider, max_concurrency: int, requests_per_second: float,
+                 failure_threshold: int = 3, cooldown_seconds: float = 30):
+        self.provider = provider
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = TokenBucket(requests_per_second)
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.latency_ewma = None
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.failure_threshold:
+            self.unhealthy_until = time.monotonic() + self.cooldown_seconds
+            logger.warning(
+                f"Provider {self.provider.name} marked unhealthy for {self.cooldown_seconds}s "
+                f"after {self.consecutive_failures} consecutive failures"
+            )
+
+
+class ProviderRouter(LLMProvider):
+    """
+    Routes completions over one or more providers, in priority order.
+
+    Each attempt is bounded by a timeout and the provider's concurrency and rate
+    limits; retryable errors are retried with jittered exponential backoff before
+    failing over to the next provider. If `hedge_after` is set, a non-streaming
+    request that hasn't finished after that many seconds is also sent to the next
+    provider and whichever answers first wins. Unhealthy providers are tried last.
+    """
+    name = "router"
+
+    def __init__(self, providers: list, max_concurrency: int = 16, requests_per_second: float = 5,
+                 timeout: float = 60, max_retries: int = 2, backoff_base: float = 0.5,
+                 backoff_max: float = 8, hedge_after: float = None):
+        self.states = [ProviderState(p, max_concurrency, requests_per_second) for p in providers]
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hedge_after = hedge_after
+
+    def _candidates(self) -> list:
+        return sorted(self.states, key=lambda state: not state.healthy) # stable: keeps priority order
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": uniform between 0 and the exponential cap
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def _call_with_retries(self, state: ProviderState, system_prompt: str, messages: list, on_delta=None,
+                                 can_retry=lambda: True) -> Completion:
+        attempt = 0
+        while True:
+            started = time.monotonic()
+            try:
+                async with state.semaphore:
+                    await state.rate_limiter.acquire()
+                    completion = await asyncio.wait_for(
+                        state.provider.complete(system_prompt, messages, on_delta=on_delta),
+                        timeout=self.timeout
+                    )
+                state.record_success(time.monotonic() - started)
+                return completion
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                state.record_failure()
+                if attempt >= self.max_retries or not state.provider.is_retryable(e) or not can_retry():
+                    raise
+                delay = self._backoff(attempt)
+                attempt += 1
+                logger.warning(f"{state.provider.name} request failed ({e!r}), retry {attempt} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+
+    async def complete(self, system_prompt: str, messages: list, on_delta=None) -> Completion:
+        candidates = self._candidates()
+        if on_delta is not None:
+            return await self._complete_streaming(candidates, system_prompt, messages, on_delta)
+
+        remaining = list(candidates)
+        tasks = set()
+        last_error = None
+
+        def launch():
+            state = remaining.pop(0)
+            tasks.add(asyncio.create_task(self._call_with_retries(state, system_prompt, messages)))
+
+        launch()
+        try:
+            while tasks:
+                timeout = self.hedge_after if remaining and self.hedge_after else None
+                done, tasks = await asyncio.wait(tasks, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"No response after {self.hedge_after}s, hedging with {remaining[0].provider.name}")
+                    launch()
+                    continue
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    last_error = task.exception()
+                if not tasks and remaining:
+                    logger.warning(f"Failing over to {remaining[0].provider.name} after error: {last_error!r}")
+                    launch()
+        finally:
+            for task in tasks:
+                task.cancel()
+        raise last_error
+
+    async def _complete_streaming(self, candidates: list, system_prompt: str, messages: list, on_delta) -> Completion:
+        # Once text has reached the user, retrying or switching providers would
+        # restart the reply mid-message, so only failures before the first token recover
+        emitted = False
+
+        async def track(text):
+            nonlocal emitted
+            emitted = True
+            await on_delta(text)
+
+        last_error = None
+        for state in candidates:
+            try:
+                return await self._call_with_retries(
+                    state, system_prompt, messages, on_delta=track, can_retry=lambda: not emitted
+                )
+            except Exception as e:
+                last_error = e
+                if emitted:
+                    raise
+                logger.warning(f"Provider {state.provider.name} failed before streaming: {e!r}")
+        raise last_error
+
+    def health(self) -> dict:
+        return {
+            state.provider.name: {
+                "healthy": state.healthy,
+                "consecutive_failures": state.consecutive_failures,
+                "latency_ewma": state.latency_ewma,
+                "requests": state.requests,
+                "failures": state.failures,
+            }
+            for state in self.states
+        }
+
+    async def close(self):
+        for state in self.states:
+            await state.provider.close()
+
+
+def create_router_from_env():
+    """
+    Build a ProviderRouter over every configured provider. Returns None if no API key is set.
+    """
+    providers = create_providers_from_env()
+    if not providers:
+        return None
+    hedge_after = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0")) or None
+    return ProviderRouter(
+        providers,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+        requests_per_second=float(os.getenv("LLM_REQUESTS_PER_SECOND", "5")),
+        timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "60")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "2")),
+        hedge_after=hedge_after
+    )
@@ -0,0 +1,236 @@
+import time
+import asyncio
+import logging
+import itertools
+from collections import deque
+from telegram import Message as TelegramMessage
+from telegram.constants import MessageLimit
+from telegram.error import RetryAfter
+
+from ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Send priorities: lower goes first when several chats are waiting
+REPLY = 0 # interview messages
+NOTICE = 1 # error and access notices
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    # python-telegram-bot is moving retry_after from int to timedelta
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list:
+    """
+    Split `text` into chunks of at most `limit` characters, preferably between
+    paragraphs, then lines, sentences or words.
+    """
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        cut = -1
+        for separator in ("\n\n", "\n", ". ", " "):
+            position = window.rfind(separator)
+            if position >= limit // 2:
+                cut = position + len(separator)
+                break
+        if cut == -1:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class _Job:
+    __slots__ = ("priority", "sequence", "chat_id", "send", "future", "attempts")
+
+    def __init__(self, priority: int, sequence: int, chat_id: int, send):
+        self.priority = priority
+        self.sequence = sequence
+        self.chat_id = chat_id
+        self.send = send
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+
+class TelegramSendQueue:
+    """
+    Schedules outgoing Bot API calls within Telegram's flood limits.
+
+    Every send takes a token from a global bucket (`global_rate` per second) and from
+    its chat's bucket (`chat_rate` per second, bursts of `chat_burst`). Messages to one
+    chat go out in order, one at a time; between chats, the waiting message with the
+    best priority goes first. On RetryAfter the chat is paused for the requested time
+    and the message is retried, up to `max_retries` times.
+
+    Usage:
+        message = await send_queue.submit(chat_id, lambda: bot.send_message(chat_id, text))
+        await send_queue.send_text(update.message, long_text, priority=NOTICE)
+    """
+
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1, chat_burst: float = 3, max_retries: int = 5):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.global_bucket = TokenBucket(global_rate)
+        self._chat_buckets = {} # chat_id -> TokenBucket
+        self._queues = {} # chat_id -> deque of jobs
+        self._busy = set() # chats with a send in flight
+        self._paused_until = {} # chat_id -> monotonic time
+        self._sends = set()
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._last_sweep = time.monotonic()
+
+    async def submit(self, chat_id: int, send, priority: int = REPLY):
+        """
+        Queue `send` (a callable returning the API call's coroutine; it is called again
+        on retries) and return its result once it has been sent.
+        """
+        job = _Job(priority, next(self._sequence), chat_id, send)
+        self._queues.setdefault(chat_id, deque()).append(job)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+        return await job.future
+
+    async def send_text(self, message: TelegramMessage, text: str, priority: int = REPLY) -> list:
+        """
+        Send `text` to the chat of `message`, split into several messages if it is too long.
+        """
+        return await asyncio.gather(*[
+            self.submit(message.chat_id, lambda chunk=chunk: message.reply_text(chunk), priority)
+            for chunk in split_message(text)
+        ])
+
+    def try_acquire(self, chat_id: int) -> bool:
+        """
+        Take a send slot for a call made outside the queue, if one is free right now
+        and nothing is waiting for the chat. Used for optional sends such as partial
+        edits of a streamed reply, which are simply skipped when the queue is busy.
+        """
+        if self._queues.get(chat_id) or chat_id in self._busy or self._pause_left(chat_id) > 0:
+            return False
+        chat_bucket = self._chat_bucket(chat_id)
+        if self.global_bucket.delay_for() > 0 or chat_bucket.delay_for() > 0:
+            return False
+        self.global_bucket.try_acquire()
+        chat_bucket.try_acquire()
+        return True
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pause_left(self, chat_id: int) -> float:
+        paused_until = self._paused_until.get(chat_id)
+        if paused_until is None:
+            return 0.0
+        left = paused_until - time.monotonic()
+        if left <= 0:
+            del self._paused_until[chat_id]
+            return 0.0
+        return left
+
+    def _next_ready(self):
+        """
+        Pop the best job whose chat may send now. Returns (job, None), or
+        (None, seconds until a chat becomes ready) with None meaning nothing is queued.
+        """
+        best = None
+        wait = None
+        for chat_id, queue in self._queues.items():
+            if chat_id in self._busy:
+                continue
+            head = queue[0]
+            delay = max(self._pause_left(chat_id), self._chat_bucket(chat_id).delay_for())
+            if delay > 0:
+                wait = delay if wait is None else min(wait, delay)
+            elif best is None or (head.priority, head.sequence) < (best.priority, best.sequence):
+                best = head
+        if best is None:
+            return None, wait
+        queue = self._queues[best.chat_id]
+        queue.popleft()
+        if not queue:
+            del self._queues[best.chat_id]
+        return best, None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.global_bucket.delay_for())
+            job, wait = self._next_ready()
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if job.future.done(): # the caller gave up
+                continue
+            self.global_bucket.try_acquire()
+            self._chat_bucket(job.chat_id).try_acquire()
+            self._busy.add(job.chat_id)
+            task = asyncio.create_task(self._send(job))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+            self._sweep()
+
+    async def _send(self, job: _Job):
+        try:
+            result = await job.send()
+        except RetryAfter as e:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                if not job.future.done():
+                    job.future.set_exception(e)
+                return
+            retry_after = retry_after_seconds(e)
+            logger.warning(f"Flood limit for chat {job.chat_id}, retrying in {retry_after:.0f}s")
+            self._paused_until[job.chat_id] = time.monotonic() + retry_after
+            self._queues.setdefault(job.chat_id, deque()).appendleft(job)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self._busy.discard(job.chat_id)
+            self._wakeup.set()
+
+    def _sweep(self):
+        # Forget chats whose bucket is full again; they behave exactly like new ones
+        now = time.monotonic()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        for chat_id in list(self._chat_buckets):
+            bucket = self._chat_buckets[chat_id]
+            if chat_id not in self._queues and chat_id not in self._busy and bucket.delay_for(bucket.capacity) == 0:
+                del self._chat_buckets[chat_id]
+
+    async def stop(self, timeout: float = 10):
+        """
+        Wait up to `timeout` seconds for queued messages to go out, then stop.
+        """
+        deadline = time.monotonic() + timeout
+        while (self._queues or self._sends) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for queue in self._queues.values():
+            for job in queue:
+                if not job.future.done():
+                    job.future.set_exception(RuntimeError("Send queue stopped"))
+        self._queues.clear()
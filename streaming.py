@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from telegram import Message as TelegramMessage
+from telegram.constants import ChatAction, MessageLimit
+from telegram.error import BadRequest, RetryAfter
+
+from send_queue import REPLY, retry_after_seconds, split_message
+
+logger = logging.getLogger(__name__)
+
+# Telegram shows "typing..." for ~5 seconds per chat action, so it's resent a bit earlier
+TYPING_ACTION_INTERVAL_SECONDS = 4
+
+
+class StreamingReply:
+    """
+    Sends an AI reply to a chat as it is being generated.
+
+    While waiting for the first token a typing indicator is shown. The first chunk is
+    sent as a new message, which is then edited at most once per `edit_interval`
+    seconds as more text arrives (Telegram rate-limits edits). `finish` writes the
+    final text.
+
+    With a `send_queue`, the first chunk and the final text go through it, and partial
+    edits are skipped while it has no free send slot for the chat.
+
+    Usage:
+        async with StreamingReply(update.message, context.bot) as reply:
+            ...
+            await reply.update(text_so_far)
+            ...
+            await reply.finish(full_text)
+    """
+
+    def __init__(self, message: TelegramMessage, bot, edit_interval: float = 1.0, min_first_chunk: int = 20,
+                 send_queue=None):
+        self.message = message
+        self.bot = bot
+        self.send_queue = send_queue
+        self.edit_interval = edit_interval
+        self.min_first_chunk = min_first_chunk
+        self.sent_message = None
+        self._shown_text = ""
+        self._next_edit_at = 0.0
+        self._typing_task = None
+
+    async def __aenter__(self):
+        self._typing_task = asyncio.create_task(self._keep_typing())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._stop_typing()
+
+    def _stop_typing(self):
+        if self._typing_task is not None:
+            self._typing_task.cancel()
+            self._typing_task = None
+
+    async def _keep_typing(self):
+        try:
+            while True:
+                await self.bot.send_chat_action(chat_id=self.message.chat_id, action=ChatAction.TYPING)
+                await asyncio.sleep(TYPING_ACTION_INTERVAL_SECONDS)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The indicator is cosmetic; never let it break the turn
+            logger.debug(f"Could not send typing action to chat {self.message.chat_id}: {e}")
+
+    async def update(self, text: str):
+        """
+        Show the partial reply `text`. Calls between throttled edits are dropped.
+        """
+        text = text[:MessageLimit.MAX_TEXT_LENGTH]
+        if self.sent_message is None:
+            if len(text.strip()) < self.min_first_chunk:
+                return
+            self._stop_typing()
+            self.sent_message = await self._reply(text)
+            self._shown_text = text
+            self._next_edit_at = time.monotonic() + self.edit_interval
+            return
+
+        if time.monotonic() < self._next_edit_at:
+            return
+        await self._edit(text)
+
+    async def finish(self, text: str):
+        """
+        Deliver the complete reply, splitting it if it exceeds Telegram's length limit.
+        """
+        self._stop_typing()
+        first, *rest = split_message(text)
+        if self.sent_message is None:
+            self.sent_message = await self._reply(first)
+            self._shown_text = first
+        else:
+            await self._edit(first, final=True)
+        for chunk in rest:
+            await self._reply(chunk)
+
+    async def _reply(self, text: str):
+        if self.send_queue is None:
+            return await self.message.reply_text(text)
+        return await self.send_queue.submit(self.message.chat_id, lambda: self.message.reply_text(text), REPLY)
+
+    async def _edit(self, text: str, final: bool = False):
+        if text == self._shown_text:
+            return
+        if self.send_queue is not None:
+            if final:
+                # The queue waits out flood limits itself
+                try:
+                    await self.send_queue.submit(self.message.chat_id, lambda: self.sent_message.edit_text(text), REPLY)
+                    self._shown_text = text
+                except BadRequest as e:
+                    logger.debug(f"Skipped edit for chat {self.message.chat_id}: {e}")
+                return
+            if not self.send_queue.try_acquire(self.message.chat_id):
+                return # retried on the next update
+        try:
+            await self.sent_message.edit_text(text)
+            self._shown_text = text
+        except RetryAfter as e:
+            retry_after = retry_after_seconds(e)
+            if final:
+                await asyncio.sleep(retry_after)
+                await self.sent_message.edit_text(text)
+                self._shown_text = text
+            else:
+                # Skip intermediate edits until the flood wait is over
+                self._next_edit_at = time.monotonic() + retry_after
+                return
+        except BadRequest as e:
+            # e.g. "message is not modified"; a later edit will catch up
+            logger.debug(f"Skipped edit for chat {self.message.chat_id}: {e}")
+        self._next_edit_at = time.monotonic() + self.edit_interval
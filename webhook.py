@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import secrets
+import signal
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def generate_secret_token() -> str:
+    # Telegram allows 1-256 characters from A-Z, a-z, 0-9, _ and -
+    return secrets.token_urlsafe(32)
+
+
+def create_webhook_app(application: Application, path: str, secret_token: str) -> web.Application:
+    """
+    aiohttp app that accepts Telegram webhook calls on `path` and hands the updates
+    to `application`. Requests are acknowledged as soon as the update is queued;
+    the application's update processor handles it concurrently with others.
+    Requests without `secret_token` in their header are rejected, since anyone who
+    finds the URL could otherwise post updates in any user's name.
+    """
+    if not secret_token:
+        raise ValueError("A webhook needs a secret token")
+
+    async def receive_update(request: web.Request) -> web.Response:
+        if not secrets.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        update = Update.de_json(data, application.bot)
+        await application.update_queue.put(update)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_post(path, receive_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def serve_webhook(application: Application, listen: str, port: int, path: str,
+                        secret_token: str, reuse_port: bool = False):
+    """
+    Run `application` behind a local webhook server until SIGINT/SIGTERM.
+    With `reuse_port`, several worker processes can bind the same port and the
+    kernel spreads incoming connections between them.
+    """
+    if not secret_token:
+        raise ValueError("A webhook needs a secret token")
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    # run_polling/run_webhook call these hooks themselves; here we drive the lifecycle
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    runner = web.AppRunner(create_webhook_app(application, path, secret_token))
+    await runner.setup()
+    site = web.TCPSite(runner, listen, port, reuse_port=reuse_port)
+    await site.start()
+    logger.info(f"Webhook worker listening on {listen}:{port}{path}")
+
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Webhook worker shutting down...")
+        await runner.cleanup()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+async def register_webhook(bot_token: str, url: str, secret_token: str, max_connections: int = 40):
+    """
+    Point Telegram at `url`. Done once by the parent process, not by every worker.
+    """
+    application = Application.builder().token(bot_token).build()
+    async with application:
+        await application.bot.set_webhook(
+            url=url,
+            secret_token=secret_token,
+            max_connections=max_connections,
+            allowed_updates=Update.ALL_TYPES
+        )
+    logger.info(f"Webhook registered at {url}")